@@ -3,6 +3,7 @@
 """
 
 import json
+import threading
 from time import time
 from math import ceil
 from geopy.compat import urlencode, urlopen, Request
@@ -22,12 +23,19 @@ class BrownArcGIS(ArcGIS):
 
     auth_api = 'http://quidditch.gis.brown.edu:6080/arcgis/tokens/generateToken'
 
+    batch_size = 300 # most addresses the server accepts in one geocodeAddresses request
+
+    token_refresh_margin = 120 # seconds before the token expires that it is replaced
+
     def __init__(self, **kwargs):
 
         super(BrownArcGIS, self).__init__(scheme='https', **kwargs)
 
         self.scheme = 'http' # https not supported
 
+        # the token is shared by every thread making requests with this geocoder
+        self._token_lock = threading.RLock()
+
         self.api = (
             '%s://quidditch.gis.brown.edu:6080/arcgis/rest/services/brown_geocoding'
             '/Street_Addresses_US/GeocodeServer/findAddressCandidates' % self.scheme
@@ -125,16 +133,18 @@ class BrownArcGIS(ArcGIS):
             )
 
         geocoded = []
-        for i in xrange(0, len(addresses), 300):
+        i = 0
+        expired_retries = 0
+        while i < len(addresses):
 
             records = []
-            for a in addresses[i:i+300]:
+            for a in addresses[i:i+self.batch_size]:
                 attributes_dict = {"attributes":{"OBJECTID":a[0],"Single Line Input":a[1]}}
                 records.append(attributes_dict)
 
             query = {"records":records}
 
-            params = {'addresses': query,
+            params = {'addresses': json.dumps(query),
                       'outSR': wkid,
                       'f': 'json'}
 
@@ -143,12 +153,12 @@ class BrownArcGIS(ArcGIS):
             logger.debug("%s.geocode: %s", self.__class__.__name__, url)
             response = self._call_geocoder(url, timeout=timeout)
 
-            # Handle any errors; recursing in the case of an expired token.
+            # Handle any errors; in the case of an expired token only this chunk is sent again
             if 'error' in response:
-                if response['error']['code'] == self._TOKEN_EXPIRED:
-                    self.retry += 1
+                if response['error']['code'] == self._TOKEN_EXPIRED and expired_retries < self._MAX_RETRIES:
+                    expired_retries += 1
                     self._refresh_authentication_token()
-                    return self.geocode(timeout=timeout)
+                    continue
                 raise GeocoderServiceError(str(response['error']))
 
             #add code for parsing output here
@@ -161,6 +171,9 @@ class BrownArcGIS(ArcGIS):
                     'location':{'x':location['location']['x'],
                                 'y':location['location']['y']}}})
 
+            i += self.batch_size
+            expired_retries = 0
+
         return {'geocoded':geocoded}
 
     def reverse(self, query, timeout=None, distance=100, wkid=DEFAULT_WKID):
@@ -217,10 +230,37 @@ class BrownArcGIS(ArcGIS):
 
         return address
 
+    def ensure_token(self):
+        """
+        Request a new token if there is none or the current one expires within token_refresh_margin,
+        so requests don't have to fail with an expired token first.
+        Calling this before forking lets the subprocesses start out with the same token.
+        """
+        with self._token_lock:
+            # (short lived tokens are replaced halfway through their lifetime instead)
+            margin = min(self.token_refresh_margin, self.token_lifetime / 2)
+            if self.token is None or int(time()) > self.token_expiry - margin:
+                self._refresh_authentication_token()
+
+    def _authenticated_call_geocoder(self, url, timeout=None):
+        """
+        Wrap self._call_geocoder, replacing the token before it expires.
+        """
+        self.ensure_token()
+        request = Request(
+            "&token=".join((url, self.token)), # no urlencoding
+            headers={"Referer": self.referer}
+        )
+        return self._base_call_geocoder(request, timeout=timeout)
+
     def _refresh_authentication_token(self):
         """
         POST to ArcGIS requesting a new token.
         """
+        with self._token_lock:
+            self.__refresh_authentication_token()
+
+    def __refresh_authentication_token(self):
         if self.retry == self._MAX_RETRIES:
             raise GeocoderAuthenticationFailure(
                 'Too many retries for auth: %s' % self.retry
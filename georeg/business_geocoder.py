@@ -1,16 +1,22 @@
 import os
 import re
+from math import isnan
 from brownarcgis import BrownArcGIS
 
 geolocator = BrownArcGIS(username = os.environ.get("BROWNGIS_USERNAME"),
                          password = os.environ.get("BROWNGIS_PASSWORD"),
                          referer = os.environ.get("BROWNGIS_REFERER"))
 
-def geocode_business(business, state = 'RI', timeout=60):
-    """geocode a business object and store the results inside it,
-    return confidence score"""
+# set this to a geocode_cache.GeocodeCache to reuse results from previous runs
+geocode_cache = None
+
+# set this to a geocode_client.ConcurrentGeocoder (made with geolocator) to send requests concurrently
+# with connection reuse, rate limiting and retries
+geocode_client = None
+
+def _clean_numeric_fields(business):
+    """Sub "I" with "1" for numeric values in the business's zip and address"""
 
-    # Sub "I" with "1" for numeric values.
     business.zip = business.zip.replace("I", "1")
     pattern = re.compile("(^|\s)([I0-9]+)(\s|$)")
     matches = re.findall(pattern, business.address)
@@ -18,17 +24,143 @@ def geocode_business(business, state = 'RI', timeout=60):
         business.address = re.sub(match, match.replace("I", "1"),
                                   business.address)
 
-    try:
-        location = geolocator.geocode(street=business.address, city=business.city,
-                state=state, zip_cd=business.zip, n_matches = 1, timeout = timeout)
-    except:
-        location = None
-
-    if location:
-        match = location["candidates"][0]["attributes"]
-        business.confidence_score = float(match["score"])
-        business.lat = match["location"]["y"]
-        business.long = match["location"]["x"]
-        return True
+_FAILED = object() # response of a request that failed (see _call_geolocator_many())
+
+def _call_geolocator_many(method, calls):
+    """
+    call a geolocator method once for each (args, kwargs) pair in calls,
+    returns the response of each call in order (_FAILED if the request failed)
+    """
+
+    if geocode_client is not None:
+        # every request is sent at once, the client limits how many are actually in flight
+        requests = [geocode_client.call_async(method, *args, **kwargs) for args, kwargs in calls]
+        get_response = lambda request: request.get()
     else:
-        return False
+        requests = calls
+        get_response = lambda (args, kwargs): getattr(geolocator, method)(*args, **kwargs)
+
+    responses = []
+    for request in requests:
+        try:
+            responses.append(get_response(request))
+        except:
+            responses.append(_FAILED)
+
+    return responses
+
+def _cache_key(business, state):
+    return geocode_cache.make_key(business.address, business.city, state, business.zip)
+
+def _store_result(business, found, score, lat, long):
+    """store a geocoder result inside business, return success"""
+
+    if found:
+        business.confidence_score = score
+        business.lat = lat
+        business.long = long
+    return found
+
+def geocode_business(business, state = 'RI', timeout=60):
+    """geocode a business object and store the results inside it,
+    return success"""
+    return geocode_each([business], state, timeout)[0]
+
+def geocode_each(businesses, state = 'RI', timeout=60):
+    """geocode a list of business objects with a request for each and store the results inside them,
+    with a geocode_client up to its max_in_flight of the requests wait on the server at once,
+    return a list of success flags in the same order as businesses"""
+
+    successes = [False] * len(businesses)
+
+    # uids of businesses that weren't in the cache
+    uids = []
+    for uid, business in enumerate(businesses):
+        _clean_numeric_fields(business)
+
+        cached = geocode_cache.get(_cache_key(business, state)) if geocode_cache is not None else None
+        if cached is not None:
+            successes[uid] = _store_result(business, *cached)
+        else:
+            uids.append(uid)
+
+    calls = [((), dict(street=businesses[uid].address, city=businesses[uid].city, state=state,
+                       zip_cd=businesses[uid].zip, n_matches = 1, timeout = timeout)) for uid in uids]
+
+    for uid, location in zip(uids, _call_geolocator_many("geocode", calls)):
+        if location is _FAILED:
+            continue # the server may just be unavailable so this isn't cached
+
+        if location:
+            match = location["candidates"][0]["attributes"]
+            result = (True, float(match["score"]), match["location"]["y"], match["location"]["x"])
+        else:
+            result = (False, 0.0, None, None)
+
+        if geocode_cache is not None:
+            geocode_cache.put(_cache_key(businesses[uid], state), *result)
+
+        successes[uid] = _store_result(businesses[uid], *result)
+
+    return successes
+
+def geocode_businesses(businesses, state = 'RI', timeout=60, retry_not_found=False):
+    """geocode a list of business objects with as few requests as possible
+    (see BrownArcGIS.geocode_batch) and store the results inside them,
+    return a list of success flags in the same order as businesses
+    (with retry_not_found addresses the cache has as not found are sent to the server again)"""
+
+    successes = [False] * len(businesses)
+
+    # uids of businesses that weren't in the cache
+    uids = []
+    for uid, business in enumerate(businesses):
+        _clean_numeric_fields(business)
+
+        cached = geocode_cache.get(_cache_key(business, state)) if geocode_cache is not None else None
+        if cached is not None and (cached[0] or not retry_not_found):
+            successes[uid] = _store_result(business, *cached)
+        else:
+            uids.append(uid)
+
+    if len(uids) == 0:
+        return successes
+
+    addresses = []
+    for uid in uids:
+        business = businesses[uid]
+        parts = [business.address, business.city, ("%s %s" % (state, business.zip)).strip()]
+        addresses.append((uid, ", ".join(p for p in parts if p)))
+
+    # one request per batch the server accepts so a failed request only loses its own batch
+    batches = [addresses[i:i + geolocator.batch_size] for i in xrange(0, len(addresses), geolocator.batch_size)]
+
+    calls = [((batch,), dict(timeout=timeout)) for batch in batches]
+
+    for batch, response in zip(batches, _call_geolocator_many("geocode_batch", calls)):
+        if response is _FAILED:
+            continue # the server may just be unavailable so these aren't cached
+
+        results = dict((uid, (False, 0.0, None, None)) for uid, _ in batch)
+
+        for location in response["geocoded"]:
+            match = location["attributes"]
+
+            # unmatched addresses come back with a zero score and no usable location
+            try:
+                score = float(match["score"])
+                coords = [float(match["location"]["y"]), float(match["location"]["x"])]
+            except (KeyError, TypeError, ValueError):
+                continue
+            if score <= 0 or any(isnan(c) for c in coords):
+                continue
+
+            results[int(location["uid"])] = (True, score, match["location"]["y"], match["location"]["x"])
+
+        for uid, result in results.iteritems():
+            if geocode_cache is not None:
+                geocode_cache.put(_cache_key(businesses[uid], state), *result)
+
+            successes[uid] = _store_result(businesses[uid], *result)
+
+    return successes
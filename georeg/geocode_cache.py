@@ -0,0 +1,103 @@
+""" Persistent cache of geocoding results shared between runs and processes."""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+
+class GeocodeCache(object):
+    """
+    sqlite backed cache of geocoder results keyed by normalized address,
+    each process (and thread) opens its own connection so one cache object can be
+    handed to every subprocess of a multiprocessing.Pool or shared between threads
+    """
+
+    def __init__(self, path, max_age=None):
+        """
+        :param path: path of the sqlite database (created if it doesn't exist)
+        :param max_age: age in seconds after which a cached result is ignored and re-queried,
+               None means cached results never expire
+        """
+        self.path = path
+        self.max_age = max_age
+
+        # per process hit/miss counters
+        self.hits = 0
+        self.misses = 0
+
+        self.__local = threading.local() # this thread's connection and the pid it was opened in
+
+    def __getstate__(self):
+        # sqlite connections can't be pickled, the new process will open its own
+        state = self.__dict__.copy()
+        del state["_GeocodeCache__local"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__local = threading.local()
+
+    @property
+    def _connection(self):
+        # connections must not be shared across a fork or between threads
+        local = self.__local
+        if getattr(local, "pid", None) != os.getpid():
+            local.connection = sqlite3.connect(self.path, timeout=60)
+            local.connection.execute("PRAGMA journal_mode=WAL")
+            local.connection.execute("CREATE TABLE IF NOT EXISTS geocodes "
+                                     "(address TEXT PRIMARY KEY, found INTEGER, score REAL, "
+                                     "lat REAL, long REAL, time REAL)")
+            local.connection.commit()
+            local.pid = os.getpid()
+        return local.connection
+
+    @staticmethod
+    def make_key(street, city, state, zip_cd):
+        """normalize an address (case, punctuation and whitespace) to a cache key"""
+        normalize = lambda s: " ".join(re.sub(r"[^\w\s]", " ", s.lower()).split())
+        return "|".join(normalize(s) for s in [street, city, state, zip_cd])
+
+    def get(self, key):
+        """
+        look up an address key made with make_key()
+        :return: None on a miss, (False, 0.0, None, None) for an address the geocoder couldn't find
+                 otherwise (True, score, lat, long)
+        """
+        row = self._connection.execute("SELECT found, score, lat, long, time FROM geocodes WHERE address = ?",
+                                       (key,)).fetchone()
+
+        if row is None or (self.max_age is not None and time.time() - row[4] > self.max_age):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        found, score, lat, long, _ = row
+        return bool(found), score, lat, long
+
+    def put(self, key, found, score=0.0, lat=None, long=None):
+        """record the geocoder's result for an address key"""
+        with self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?, ?, ?)",
+                                     (key, int(found), score, lat, long, time.time()))
+
+    def invalidate(self, older_than=None):
+        """
+        remove cached results
+        :param older_than: only remove results older than this many seconds, None removes everything
+        """
+        with self._connection:
+            if older_than is None:
+                self._connection.execute("DELETE FROM geocodes")
+            else:
+                self._connection.execute("DELETE FROM geocodes WHERE time < ?", (time.time() - older_than,))
+
+    def reset_stats(self):
+        """resets the hit/miss counters"""
+        self.hits = 0
+        self.misses = 0
+
+    def hit_rate(self):
+        """returns hit rate as a percent or -1 if the cache hasn't been used yet"""
+        lookups = self.hits + self.misses
+        return self.hits * 100.0 / lookups if lookups > 0 else -1
@@ -0,0 +1,195 @@
+""" Concurrent geocoding requests over reused connections."""
+
+import os
+import time
+import random
+import socket
+import threading
+import httplib
+import urllib
+import urllib2
+import urlparse
+import cStringIO
+from multiprocessing.pool import ThreadPool
+
+from geopy.exc import GeocoderServiceError, GeocoderQueryError, GeocoderAuthenticationFailure, \
+    GeocoderInsufficientPrivileges
+
+class KeepAliveOpener(object):
+    """
+    replacement for the urlopen function a geopy geocoder makes its requests with,
+    connections are kept open (HTTP/1.1 keep-alive) and reused by later requests to the same host
+    instead of opening a new connection for every request
+    """
+
+    def __init__(self, max_idle=8):
+        """:param max_idle: most idle connections to keep open per host"""
+        self.max_idle = max_idle
+
+        self.__idle = {} # (scheme, host) -> list of idle connections
+        self.__lock = threading.Lock()
+        self.__pid = os.getpid()
+
+    def __call__(self, request, timeout=None):
+        if isinstance(request, basestring):
+            request = urllib2.Request(request)
+
+        url = request.get_full_url()
+        scheme, host, path, query, _ = urlparse.urlsplit(url)
+        key = (scheme, host)
+        path = (path or "/") + ("?" + query if query else "")
+        method = "POST" if request.has_data() else "GET"
+
+        for attempt in xrange(2):
+            connection, reused = self.__get_connection(key, timeout)
+            try:
+                connection.request(method, path, request.get_data(), dict(request.header_items()))
+                response = connection.getresponse()
+                body = response.read()
+            except socket.timeout:
+                connection.close()
+                raise
+            except (httplib.HTTPException, socket.error) as e:
+                connection.close()
+                # the server may have closed a connection that sat idle, so try once more with a new one
+                if reused and attempt == 0:
+                    continue
+                raise urllib2.URLError(e)
+            break
+
+        if response.will_close:
+            connection.close()
+        else:
+            self.__put_connection(key, connection)
+
+        # behave like urllib2.urlopen() so geopy can handle the response as usual
+        if response.status >= 400:
+            raise urllib2.HTTPError(url, response.status, response.reason, response.msg, cStringIO.StringIO(body))
+        return urllib.addinfourl(cStringIO.StringIO(body), response.msg, url, response.status)
+
+    def __get_connection(self, key, timeout):
+        """returns (connection, whether it was used before)"""
+        with self.__lock:
+            # connections must not be shared across a fork
+            if self.__pid != os.getpid():
+                self.__idle = {}
+                self.__pid = os.getpid()
+
+            idle = self.__idle.get(key)
+            connection = idle.pop() if idle else None
+
+        if connection is None:
+            scheme, host = key
+            connection_type = httplib.HTTPSConnection if scheme == "https" else httplib.HTTPConnection
+            return connection_type(host, timeout=timeout), False
+
+        connection.timeout = timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(timeout)
+        return connection, True
+
+    def __put_connection(self, key, connection):
+        with self.__lock:
+            idle = self.__idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+
+class TokenBucket(object):
+    """thread safe rate limiter, acquire() blocks until a request may be sent"""
+
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: requests per second
+        :param capacity: most requests that can be sent at once after a quiet period (defaults to rate)
+        """
+        self.rate = float(rate)
+        self.capacity = capacity if capacity is not None else max(1.0, self.rate)
+
+        self.__tokens = self.capacity
+        self.__last_time = time.time()
+        self.__lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.__lock:
+                now = time.time()
+                self.__tokens = min(self.capacity, self.__tokens + (now - self.__last_time) * self.rate)
+                self.__last_time = now
+
+                if self.__tokens >= 1:
+                    self.__tokens -= 1
+                    return
+
+                wait = (1 - self.__tokens) / self.rate
+            time.sleep(wait)
+
+
+class ConcurrentGeocoder(object):
+    """
+    makes the requests of a geopy geocoder (i.e. BrownArcGIS) from a pool of threads so up to
+    max_in_flight requests are waiting on the server at once, requests share keep-alive connections,
+    are rate limited and retried with exponential backoff if the server fails or times out.
+    The thread pool is started on first use in each process so this can be set up before forking
+    """
+
+    # errors that won't go away by asking again
+    _permanent_errors = (GeocoderQueryError, GeocoderAuthenticationFailure, GeocoderInsufficientPrivileges)
+
+    def __init__(self, geolocator, max_in_flight=8, rate=None, max_retries=3, backoff=0.5):
+        """
+        :param geolocator: geopy geocoder to make requests with, its connections will be reused
+        :param max_in_flight: number of requests that can be waiting on the server at once
+        :param rate: most requests per second (per process), None means no limit
+        :param max_retries: times to retry a request that failed with a GeocoderServiceError
+        :param backoff: seconds to wait before the first retry (doubled for each one after)
+        """
+        self.geolocator = geolocator
+        self.max_in_flight = max_in_flight
+        self.rate_limiter = TokenBucket(rate) if rate else None
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        geolocator.urlopen = KeepAliveOpener(max_in_flight)
+
+        self.__pool = None
+        self.__pid = None
+
+    @property
+    def _pool(self):
+        # threads don't survive a fork
+        if self.__pool is None or self.__pid != os.getpid():
+            self.__pool = ThreadPool(self.max_in_flight)
+            self.__pid = os.getpid()
+        return self.__pool
+
+    def call(self, method, *args, **kwargs):
+        """call geolocator.method(*args, **kwargs) in this thread, rate limited and retried on failure"""
+
+        for attempt in xrange(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+
+            try:
+                return getattr(self.geolocator, method)(*args, **kwargs)
+            except self._permanent_errors:
+                raise
+            except GeocoderServiceError:
+                if attempt == self.max_retries:
+                    raise
+
+            # randomize the wait a bit so failed requests don't all come back at once
+            time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    def call_async(self, method, *args, **kwargs):
+        """like call() but made by the thread pool, returns a multiprocessing.pool.AsyncResult"""
+        return self._pool.apply_async(self.call, (method,) + args, kwargs)
+
+    def close(self):
+        """wait for outstanding requests and stop this process's threads"""
+        if self.__pool is not None and self.__pid == os.getpid():
+            self.__pool.close()
+            self.__pool.join()
+        self.__pool = None
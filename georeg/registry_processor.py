@@ -2,14 +2,22 @@
 import cv2
 import numpy as np
 import os
+import re
+import bisect
 import csv
+import json
+import cStringIO
 import sys
 import ConfigParser
 import itertools
 import collections
+import threading
+import time
+import Queue
 import spell_checker
 import business_geocoder as geo
 from math import sqrt
+from multiprocessing.pool import ThreadPool
 from operator import itemgetter, attrgetter
 from sklearn.cluster import KMeans
 
@@ -17,10 +25,30 @@ import georeg
 from tessapi import TessBaseAPI
 
 class CityDetector(spell_checker.SpellChecker):
-    """loads a file of cities for comparison against strings"""
-    def __init__(self, similarity_thresh = 50):
+    """
+    loads a file of cities for comparison against strings,
+    the most recent matches are cached since the same headers (and OCR errors) show up on every page
+    """
+    def __init__(self, similarity_thresh = 50, cache_size = 2000):
         super(CityDetector, self).__init__(similarity_thresh)
-        
+
+        self.cache_size = cache_size
+        self.__cache = collections.OrderedDict() # (normalized line, cutoff) -> city or None, least recently used first
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def add_token(self, token_str, token_count):
+        super(CityDetector, self).add_token(token_str, token_count)
+        self.__cache.clear()
+
+    def add_tokens(self, tokens, processes=1):
+        super(CityDetector, self).add_tokens(tokens, processes)
+        self.__cache.clear()
+
+    def remove_all_tokens(self):
+        super(CityDetector, self).remove_all_tokens()
+        self.__cache.clear()
+
     def load_cities_txt_file(self, file_name):
         with open(file_name) as file:
             for line in file:
@@ -28,18 +56,53 @@ class CityDetector(spell_checker.SpellChecker):
                 self.add_token(line, 1)
 
     def match_to_cities(self, line, cutoff=60):
-        line = line.lower().strip()
+        return self.match_many_to_cities([line], cutoff)[line]
+
+    def match_many_to_cities(self, lines, cutoff=60):
+        """match many lines at once (see SpellChecker.correct_many()), returns a dict of line -> city or None"""
+
+        matches = {}
+        uncached_lines = {} # line -> string to be spell checked
+
+        for line in set(lines):
+            key = (line.lower().strip(), cutoff)
+
+            if key in self.__cache:
+                matches[line] = self.__cache[key] = self.__cache.pop(key) # move to most recently used
+                self.cache_hits += 1
+            else:
+                uncached_lines[line] = self.__strip_continued(key[0], cutoff)
+                self.cache_misses += 1
+
+        corrections = self.correct_many(uncached_lines.itervalues())
+
+        for line, stripped_line in uncached_lines.iteritems():
+            match, ratio = corrections[stripped_line]
+            matches[line] = match if ratio >= cutoff else None
+
+            self.__cache[(line.lower().strip(), cutoff)] = matches[line]
+            if len(self.__cache) > self.cache_size:
+                self.__cache.popitem(last=False)
 
+        return matches
+
+    @staticmethod
+    def __strip_continued(line, cutoff):
         # if the end of the string matches "—continued" then remove it
         if spell_checker.ratio(line[-12:], "-continued") > cutoff:
             line = line[:-12]
 
-        match, ratio = self.get_best_spelling_correction(line)
+        return line
 
-        if ratio >= cutoff:
-            return match
-        else:
-            return None
+    def cache_hit_rate(self):
+        """returns hit rate as a percent or -1 if the cache hasn't been used yet"""
+        lookups = self.cache_hits + self.cache_misses
+        return self.cache_hits * 100.0 / lookups if lookups > 0 else -1
+
+    def reset_cache_stats(self):
+        """resets the cache hit/miss counters"""
+        self.cache_hits = 0
+        self.cache_misses = 0
 
 class Business:
 
@@ -63,7 +126,69 @@ class Business:
         self.image_file = ""
 
 
+# a contour table is a numpy array with a row of this type for each contour of an image, it holds
+# all that's needed of a contour until it's OCRed (label is the contour's index in _get_contours())
+contour_dtype = np.dtype([("x", np.int32), ("y", np.int32), ("w", np.int32), ("h", np.int32),
+                          ("x_mid", np.int32), ("y_mid", np.int32), ("label", np.int32)])
+
+def make_contour_table(boxes):
+    """make a contour table from a sequence of [x, y, w, h] bounding boxes (labeled by index)"""
+    boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+
+    table = np.zeros(len(boxes), dtype=contour_dtype)
+    for ix, name in enumerate(("x", "y", "w", "h")):
+        table[name] = boxes[:, ix]
+    table["x_mid"] = table["x"] + table["w"] / 2
+    table["y_mid"] = table["y"] + table["h"] / 2
+    table["label"] = np.arange(len(boxes))
+
+    return table
+
+def contour_table_from_contours(contours):
+    """make a contour table from cv2 contour data (labeled by index)"""
+    return make_contour_table([cv2.boundingRect(c) for c in contours])
+
+def fused_kernel(kernel_shape, iterations, scale=1.0):
+    """
+    repeating an operation n times with a rectangular kernel is the same as doing it once with
+    one n * (size - 1) + 1 across anchored at n times the anchor, returns (kernel, anchor) of that one
+    (scaled down to the nearest odd size and anchored at its center if scale isn't 1,
+    even sized kernels shift what they close by a pixel every iteration)
+    """
+    shape = [iterations * (k - 1) + 1 for k in kernel_shape]
+
+    if scale != 1.0:
+        shape = [max(1, 2 * int(round((s * scale - 1) / 2.0)) + 1) for s in shape]
+        anchor = (-1, -1)
+    else:
+        anchor = tuple(iterations * (k / 2) for k in kernel_shape)
+
+    return cv2.getStructuringElement(cv2.MORPH_RECT, tuple(shape)), anchor
+
+def close_and_open(thresh_image, kernel_shape, iterations, scale=1.0):
+    """
+    close a thresholded image iterations times (to make solid contours) then open it iterations / 3 times
+    (to remove noise) with a kernel_shape rectangle, each with a single fused kernel (see fused_kernel()),
+    pass the scale the image has been resized by so the kernels are scaled to match
+    """
+    close_kernel, close_anchor = fused_kernel(kernel_shape, iterations, scale)
+    open_kernel, open_anchor = fused_kernel(kernel_shape, iterations / 3, scale)
+
+    # close operation to fill contours
+    closed = cv2.morphologyEx(thresh_image, cv2.MORPH_CLOSE, close_kernel, anchor = close_anchor)
+
+    # perform an open operation to remove noise
+    return cv2.morphologyEx(closed, cv2.MORPH_OPEN, open_kernel, anchor = open_anchor)
+
 class Contour:
+    @staticmethod
+    def from_table_row(row):
+        """make a Contour (without contour data) from a row of a contour table"""
+        contour = Contour()
+        contour.x, contour.y, contour.w, contour.h, contour.x_mid, contour.y_mid = \
+            [int(row[name]) for name in ("x", "y", "w", "h", "x_mid", "y_mid")]
+        return contour
+
     def __init__(self, contour_data=None):
         self.data = contour_data
         self.text = ""
@@ -82,21 +207,74 @@ class Contour:
             self.x_mid = 0
             self.y_mid = 0
 
+class SortedContours(object):
+    """
+    contours sorted by y so those between two y-coords (i.e. the registries under a header)
+    can be found with a binary search
+    """
+
+    def __init__(self, contours):
+        # contours of a column are already sorted by y (see _make_contour_columns()) so this costs little
+        self.contours = sorted(contours, key=attrgetter('y'))
+        self.ys = [c.y for c in self.contours]
+
+    def between(self, top, bottom=None):
+        """returns the contours with top < y < bottom (in order), a bottom of None means no limit"""
+        start = bisect.bisect_right(self.ys, top)
+        end = bisect.bisect_left(self.ys, bottom) if bottom is not None else len(self.ys)
+        return self.contours[start:end]
+
+class ColumnClustering(object):
+    """column assignments of contours, in the same form as a fitted sklearn KMeans object"""
+
+    def __init__(self, labels, cluster_centers, inertia):
+        self.labels_ = labels # column index of each contour
+        self.cluster_centers_ = cluster_centers # mean [left, right] x-coords of each column's contours
+        self.inertia_ = inertia # sum of squared distances of contours to their column's center
+
+    @staticmethod
+    def fit(coords, centers, max_iterations=20):
+        """
+        k-means iterations over the [left, right] coords of contours starting from centers,
+        :return: ColumnClustering or None if a column ends up without contours
+        """
+        for _ in xrange(max_iterations):
+            distances = ((coords[:, np.newaxis, :] - centers[np.newaxis, :, :]) ** 2).sum(axis=2)
+            labels = distances.argmin(axis=1)
+
+            if (np.bincount(labels, minlength=len(centers)) == 0).any():
+                return None
+
+            new_centers = np.array([coords[labels == ix].mean(axis=0) for ix in xrange(len(centers))])
+            if np.array_equal(new_centers, centers):
+                break
+            centers = new_centers
+        else:
+            distances = ((coords[:, np.newaxis, :] - centers[np.newaxis, :, :]) ** 2).sum(axis=2)
+            labels = distances.argmin(axis=1)
+
+        return ColumnClustering(labels, centers, distances.min(axis=1).sum())
+
+    def is_consistent(self):
+        """true if each column's contours end (on average) before those of the column to its right begin"""
+        centers = self.cluster_centers_[np.argsort(self.cluster_centers_[:, 0])]
+        return bool((centers[:-1, 1] < centers[1:, 0]).all())
+
 class RegistryProcessor(object):
 
     # lambdas were no longer sufficient with multiple threads for some reason
     @property
     def _image_height(self):
-        return self.__image.shape[0]
+        return self.__thresh_image.shape[0]
 
     @property
     def _image_width(self):
-        return self.__image.shape[1]
+        return self.__thresh_image.shape[1]
 
     @property
-    def _geoquery_log_fn(self):
+    def geoquery_log_fn(self):
         assert (self.state != "" and self.year != -1)
-        return os.path.join(self.outdir, "unsucessful_geo-queries_%s_%d.log" % (self.state, self.year))
+        return os.path.join(self.outdir, "unsucessful_geo-queries_%s_%d.jsonl" % (self.state, self.year))
 
     def _expand_bb(self, x, y, w, h):
         return \
@@ -113,30 +291,51 @@ class RegistryProcessor(object):
     # when RegistryProcessor object is copied into a new subprocess
     # our tess api object needs to be recreated so we made a function to do it
     def make_tess_api(self):
-        self._tess_api = TessBaseAPI()
+        self._tess_api = self._new_tess_api()
+
+        # the extra apis used with ocr_threads are made when first needed
+        self.__ocr_pool = None
+        self.__ocr_apis = None
+
+    def _new_tess_api(self):
+        tess_api = TessBaseAPI()
 
         # set some tesseract parameters
-        if not self._tess_api.SetVariable("tessedit_pageseg_mode", "6"):
+        if not tess_api.SetVariable("tessedit_pageseg_mode", "6"):
             raise RuntimeError("error setting tesseract psm")
-        if not self._tess_api.SetVariable("tessedit_char_whitelist", "\"#%&'()*+,-./\\0123456789:;ABCDEFGHIJKLMNOPQRSTUVWXYZ[]_abcdefghijklmnopqrstuvwxyz"):
+        if not tess_api.SetVariable("tessedit_char_whitelist", "\"#%&'()*+,-./\\0123456789:;ABCDEFGHIJKLMNOPQRSTUVWXYZ[]_abcdefghijklmnopqrstuvwxyz"):
             raise RuntimeError("error setting tesseract character whitelist")
 
         # uncomment this to register the generalized spellchecker with the tesseract api
-        #self._tess_api.RegisterSpellCheckCallback(lambda str, conf: RegistryProcessor._spellcheck_callback(self, str, conf))
+        # (or turn on spellcheck_text to correct all of a page's words at once after it is OCRed)
+        #tess_api.RegisterSpellCheckCallback(lambda str, conf: RegistryProcessor._spellcheck_callback(self, str, conf))
+
+        return tess_api
 
     def initialize_spell_checkers(self):
         """initialize both the general spell checker and city detector"""
 
         basepath = georeg.__path__[0]
 
-        self._spell_checker.load_dictionary_from_tsv(os.path.abspath(os.path.join(basepath, "data", self.state + "_vocab.tsv")))
+        self._load_spell_checker_dictionary()
         self._city_detector.load_cities_txt_file(os.path.join(basepath, "data", "%s-cities.txt" % self.state))
 
+    def _load_spell_checker_dictionary(self):
+        """load the general spell checker's vocab, preferring the memory mapped version if one has been written"""
+
+        path = os.path.abspath(os.path.join(georeg.__path__[0], "data", self.state + "_vocab"))
+
+        if os.path.exists(path + ".bin"):
+            self._spell_checker.load_dictionary_from_bin(path)
+        else:
+            self._spell_checker.load_dictionary_from_tsv(path)
+
     def uninitialize_spell_checkers(self):
         """
         uninitialize both spell checkers,
         this needs to be called before a RegistryProcessor object is copied to another subprocess
         otherwise python will crash attempting to copy spellchecker's complicated innards
+        (not needed for a spell checker loaded from a .bin dictionary, which is simply mapped again)
         """
         self._spell_checker.remove_all_tokens()
         self._city_detector.remove_all_tokens()
@@ -155,6 +354,12 @@ class RegistryProcessor(object):
         self._spell_checker = spell_checker.SpellChecker()
         self._city_detector = CityDetector()
 
+        # correct the spelling of the column contours' text with the general spell checker (one batch per page)
+        self.spellcheck_text = False
+
+        # line -> city (or None) of the lines of the current page matched to cities (see _get_city_lines())
+        self._page_city_matches = {}
+
         self.__image = None
         self.__thresh_image = None
 
@@ -174,6 +379,16 @@ class RegistryProcessor(object):
 
         self.std_thresh = 1  # number of standard deviations beyond which contour is no longer considered part of column
 
+        # "kmeans" finds the columns of each image with sklearn's KMeans, "gaps" splits the contours at the
+        # widest gaps between them (or starts from the columns of the previous image) and only falls back to
+        # KMeans if the columns found overlap
+        self.column_detection = "kmeans"
+        self.__previous_column_centers = None
+
+        # contours are found on a copy of the image scaled by this much (e.g. 0.5) and scaled back up,
+        # lower values take much less memory and time on high resolution scans
+        self.contour_scale = 1.0
+
         # performance & accuracy stats
         self.__ocr_confidence_sum = 0
         self.__num_words = 0
@@ -190,6 +405,27 @@ class RegistryProcessor(object):
         self.state = ""
         self.year = -1
 
+        # when on, process_image() only queues businesses for geocoding and
+        # geocode_queued_businesses() must be called to geocode them in batches
+        self.batch_geocoding = False
+        self.geocode_batch_size = 300 # number of queued businesses worth sending at once
+        self.__geocode_queue = [] # (business, contour text) pairs waiting to be geocoded
+
+        # when on, process_image() hands its businesses to a background thread for geocoding and moves on,
+        # collect_geocoded_businesses() must be called to get them back once they have been geocoded
+        self.pipelined_geocoding = False
+        self.ocr_threads = 1 # tesseract apis to OCR the column contours of an image with at once
+        self.geocode_pipeline_depth = 2 # images that can wait on the geocoding thread before process_image() blocks
+        self.__pipeline_input = None # (created when first used since threads and queues can't be copied to subprocesses)
+        self.__pipeline_output = None
+        self.__num_pipelined_images = 0
+
+        # failed geo-queries waiting to be written to the log (see write_geoquery_log()), they are written
+        # whenever businesses are done being geocoded unless this is on, then format_geoquery_log() must be
+        # called to get them (i.e. to hand them to a single writer)
+        self.buffer_geoquery_log = False
+        self.__unsuccessful_geoqueries = []
+
     #initialize this object for the specified state and year (if not done already)
     def initialize_state_year(self, state, year, init_city_detector = True, init_spellchecker = True):
 
@@ -202,32 +438,114 @@ class RegistryProcessor(object):
         if init_city_detector:
             self._city_detector.load_cities_txt_file(os.path.join(basepath, "data", "%s-cities.txt" % self.state))
         if init_spellchecker:
-            self._spell_checker.load_dictionary_from_tsv(os.path.abspath(os.path.join(basepath, "data", state + "_vocab.tsv")))
+            self._load_spell_checker_dictionary()
 
         # load config file from this state & year
         self.load_settings_from_cfg(os.path.join(basepath, "configs", state, str(year) + ".cfg"))
 
+        # columns of another registry are no place to start from
+        self.__previous_column_centers = None
+
     # this function should not need to be overriden
     def process_image(self, path):
-        """process a registry image and store results in the businesses member"""
+        """
+        process a registry image and store results in the businesses member,
+        geo-queries that failed are appended to the geoquery log (see geoquery_log_fn) before returning
+        unless buffer_geoquery_log is on, then they are kept until format_geoquery_log() is called
+        (with batch_geocoding or pipelined_geocoding the ones that fail later are written (or kept) once
+        geocode_queued_businesses() or collect_geocoded_businesses() gets to them)
+        """
 
         self.businesses = [] # reset businesses list
 
+        column_contours, noncolumn_contours = self._ocr_image(path)
+
+        # get our custom call args if any
+        call_args = self._define_contour_call_args(column_contours, noncolumn_contours)
+
+        # match the page's city lines in one batch so each distinct line is only matched once
+        self._page_city_matches = self._city_detector.match_many_to_cities(self._get_city_lines(call_args))
+
+        num_businesses_found = 0
+        businesses_to_geocode = [] # (business, contour text) pairs
+
+        # if args is indeed multiple arguments then we'll expand them
+        if isinstance(call_args[0], collections.Sequence) and not isinstance(call_args[0], basestring):
+            def process_with_args(args):
+                return self._process_contour(*args), args[0]
+        else:  # otherwise we treat it like one argument
+            def process_with_args(args):
+                return self._process_contour(args), args
+
+        # here we process all of our contours
+        for args in call_args:
+            business, contour_txt = process_with_args(args)
+
+            if business is None:
+                raise TypeError("'NoneType' returned by _process_contour for business value, please return empty business objects instead")
+
+            business.image_file = path
+
+            num_businesses_found += 1
+            self.__num_geo_attempts += 1
+
+            # businesses without an address can't be geocoded
+            if not business.address:
+                self._log_unsuccessful_geoquery(business, contour_txt)
+                continue
+
+            # record business
+            self.businesses.append(business)
+            businesses_to_geocode.append((business, contour_txt))
+
+        # record the number of businesses found in this image
+        self.__per_image_business_counts.append(num_businesses_found)
+
+        # businesses are only handed on once the whole image has been processed,
+        # that way nothing is left behind to be geocoded (and recorded) for an image that failed
+        if self.batch_geocoding:
+            # leave geocoding for geocode_queued_businesses()
+            self.__geocode_queue.extend(businesses_to_geocode)
+        elif self.pipelined_geocoding:
+            self.__start_geocoding_pipeline()
+
+            # blocks if the geocoding thread has fallen geocode_pipeline_depth images behind
+            self.__pipeline_input.put(businesses_to_geocode)
+            self.__num_pipelined_images += 1
+        else:
+            # all at once so a geocode_client can have several requests waiting on the server
+            successes = geo.geocode_each([business for business, _ in businesses_to_geocode], self.state)
+            self.__record_geocode_results(businesses_to_geocode, successes)
+
+        self._flush_geoquery_log()
+
+    def _load_image(self, path):
+        """load the (grayscale) image the next _get_contours(make_new_thresh = True) works on"""
         self.__image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
 
-        contours = self._get_contours(make_new_thresh = True)
-        contours = [Contour(c) for c in contours]
+    def _ocr_image(self, path):
+        """
+        find the contours of a registry image and OCR them
+        :return: column_contours, noncolumn_contours (see _make_contour_columns())
+        """
+
+        self._load_image(path)
+
+        contour_table = self._get_contour_table(make_new_thresh = True)
 
         #remove noise from edge of image
         if not self.assume_pre_processed:
-            contours = self._remove_edge_contours(contours)
+            contour_table = self._remove_edge_contours(contour_table)
 
         if self.draw_debug_images:
             canvas = np.zeros(self.__image.shape, self.__image.dtype)
-            cv2.drawContours(canvas,[c.data for c in
-                contours],-1,self.line_color,-1)
+            for row in contour_table:
+                cv2.rectangle(canvas, (row["x"], row["y"]), (row["x"] + row["w"] - 1, row["y"] + row["h"] - 1),
+                              self.line_color, -1)
             cv2.imwrite(os.path.join(self.outdir, "closed.tiff"), canvas)
 
+        contours = [Contour.from_table_row(row) for row in contour_table]
+
         clustering = self._find_column_locations(contours)
         column_contours, noncolumn_contours = self._make_contour_columns(contours, clustering)
 
@@ -246,20 +564,28 @@ class RegistryProcessor(object):
             draw_rect = lambda contoured, x, y, w, h: None
 
         # OCR our column contours
+        rects = []
         for contour in itertools.chain.from_iterable(column_contours):
             x,y,w,h = self._expand_bb(contour.x,contour.y,contour.w,contour.h)
 
             draw_rect(contoured, x, y, w, h)
+            rects.append((x, y, w, h))
 
-            # specify region tesseract should ocr
-            self._tess_api.SetRectangle(x,y,w,h)
-            contour.text, contour.font_attrs = self._tess_api.GetTextWithAttrs()
+        if self.ocr_threads > 1:
+            ocr_results = self.__ocr_rects_parallel(rects)
+        else:
+            ocr_results = [self.__ocr_rect(self._tess_api, rect) for rect in rects]
 
-            total_conf, num_words = self._tess_api.TotalConfidence()
+        for contour, (text, font_attrs, total_conf, num_words) in \
+                itertools.izip(itertools.chain.from_iterable(column_contours), ocr_results):
+            contour.text, contour.font_attrs = text, font_attrs
 
             self.__ocr_confidence_sum += total_conf
             self.__num_words += num_words
 
+        if self.spellcheck_text:
+            self._spellcheck_contours(itertools.chain.from_iterable(column_contours))
+
         # OCR our noncolumn contours of interest
         for contour in noncolumn_contours:
             x, y, w, h = self._expand_bb(contour.x, contour.y, contour.w, contour.h)
@@ -275,60 +601,205 @@ class RegistryProcessor(object):
             # write original image with added contours to disk
             cv2.imwrite(os.path.join(self.outdir, "contoured.tiff"), contoured)
 
-        # get our custom call args if any
-        call_args = self._define_contour_call_args(column_contours, noncolumn_contours)
+        return column_contours, noncolumn_contours
 
-        num_businesses_found = 0
+    def __start_geocoding_pipeline(self):
+        if self.__pipeline_input is not None:
+            return
 
-        if not os.path.exists(self._geoquery_log_fn): # if the log doesn't exist make it
-            file = open(self._geoquery_log_fn, "w")
-            file.close()
+        self.__pipeline_input = Queue.Queue(maxsize=self.geocode_pipeline_depth)
+        self.__pipeline_output = Queue.Queue()
 
-        # if args is indeed multiple arguments then we'll expand them
-        if isinstance(call_args[0], collections.Sequence) and not isinstance(call_args[0], basestring):
-            def process_with_args(args):
-                return self._process_contour(*args), args[0]
-        else:  # otherwise we treat it like one argument
-            def process_with_args(args):
-                return self._process_contour(args), args
+        thread = threading.Thread(target=self.__geocoding_pipeline_f)
+        thread.daemon = True
+        thread.start()
 
-        # here we process all of our contours
-        for args in call_args:
-            business, contour_txt = process_with_args(args)
-            business.image_file = path
+    def __geocoding_pipeline_f(self):
+        """geocode the businesses of each image process_image() hands us"""
 
-            num_businesses_found += 1
-            self.__num_geo_attempts += 1
+        while True:
+            businesses = self.__pipeline_input.get()
+
+            try:
+                successes = geo.geocode_each([business for business, _ in businesses], self.state)
+                results = [(business, contour_txt, success)
+                           for (business, contour_txt), success in zip(businesses, successes)]
+            except Exception:
+                results = sys.exc_info()
 
-            result = None
+            self.__pipeline_output.put(results)
 
+    @property
+    def num_pipelined_images(self):
+        """number of images whose businesses haven't been returned by collect_geocoded_businesses() yet"""
+        return self.__num_pipelined_images
+
+    def collect_geocoded_businesses(self, wait=False):
+        """
+        get the businesses the geocoding thread has finished with (only used with pipelined_geocoding),
+        afterwards self.businesses holds them (so they can be recorded with record_to_tsv())
+        if the geocoding of an image failed its exception is raised once the other images' businesses
+        have been collected (they are in self.businesses)
+        :param wait: wait for every image handed to the geocoding thread to be finished
+        :return: the list of businesses that were geocoded
+        """
+
+        self.businesses = []
+        exc_info = None # first exception from the geocoding thread
+
+        while self.__num_pipelined_images > 0:
             try:
-                # if address was found attempt to geocode
-                if business.address:
-                    result = geo.geocode_business(business, self.state)
+                results = self.__pipeline_output.get(block=wait)
+            except Queue.Empty:
+                break
 
-                    # record business
-                    self.businesses.append(business)
+            self.__num_pipelined_images -= 1
 
-                if not result:
-                    with open(self._geoquery_log_fn, "a") as file:
-                        file.write("Unsuccessful geo-query from %s:\n" % os.path.basename(path))
-                        file.write("name: \"%s\" address: \"%s\", city: \"%s\", zip: \"%s\"\n" % (
-                            business.name, business.address, business.city, business.zip))
-                        file.write("=" * 100 + "\n")
-                        file.write("Contour Text:\n")
-                        file.write("=" * 100 + "\n")
-                        file.write(contour_txt.strip() + "\n")  # write contour text
-                        file.write("=" * 100 + "\n\n")
-                else:
+            # exceptions from the geocoding thread are passed on after the rest are collected
+            if isinstance(results, tuple):
+                if exc_info is None:
+                    exc_info = results
+                continue
+
+            for business, contour_txt, success in results:
+                if success:
                     self.__num_geo_successes += 1
-            except AttributeError:
-                if business is None:
-                    raise TypeError("'NoneType' returned by _process_contour for business value, please return empty business objects instead")
-                else: raise
+                else:
+                    self._log_unsuccessful_geoquery(business, contour_txt)
 
-        # record the number of businesses found in this image
-        self.__per_image_business_counts.append(num_businesses_found)
+                self.businesses.append(business)
+
+        self._flush_geoquery_log()
+
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+        return self.businesses
+
+    @staticmethod
+    def __ocr_rect(tess_api, rect):
+        """OCR a rectangle of the image set in tess_api, returns (text, font attributes, total confidence, number of words)"""
+
+        # specify region tesseract should ocr
+        tess_api.SetRectangle(*rect)
+        text, font_attrs = tess_api.GetTextWithAttrs()
+        total_conf, num_words = tess_api.TotalConfidence()
+
+        return text, font_attrs, total_conf, num_words
+
+    def __ocr_rects_parallel(self, rects):
+        """OCR rectangles of the thresholded image with ocr_threads tesseract apis, results are in the same order"""
+
+        if self.__ocr_pool is None:
+            self.__ocr_pool = ThreadPool(self.ocr_threads)
+
+            # [api, image it was last given] for each thread
+            self.__ocr_apis = Queue.Queue()
+            for _ in xrange(self.ocr_threads):
+                self.__ocr_apis.put([self._new_tess_api(), None])
+
+        image = self.__thresh_image
+
+        def ocr(rect):
+            entry = self.__ocr_apis.get()
+            try:
+                if entry[1] is not image:
+                    entry[0].SetImage(image)
+                    entry[1] = image
+                return self.__ocr_rect(entry[0], rect)
+            finally:
+                self.__ocr_apis.put(entry)
+
+        return self.__ocr_pool.map(ocr, rects)
+
+    @property
+    def num_queued_geocodes(self):
+        """number of businesses waiting on geocode_queued_businesses() (only used with batch_geocoding)"""
+        return len(self.__geocode_queue)
+
+    def geocode_queued_businesses(self):
+        """
+        geocode every business queued by process_image() while batch_geocoding is on
+        using as few requests to the geocoding server as possible,
+        afterwards self.businesses holds the geocoded businesses (so they can be recorded with record_to_tsv())
+        :return: the list of businesses that were geocoded
+        """
+
+        queue = self.__geocode_queue
+        self.__geocode_queue = []
+
+        successes = geo.geocode_businesses([business for business, _ in queue], self.state)
+        self.__record_geocode_results(queue, successes)
+
+        self.businesses = [business for business, _ in queue]
+
+        self._flush_geoquery_log()
+
+        return self.businesses
+
+    def __record_geocode_results(self, businesses, successes):
+        """count the successes and log the failures of (business, contour text) pairs that were geocoded"""
+        for (business, contour_txt), success in zip(businesses, successes):
+            if success:
+                self.__num_geo_successes += 1
+            else:
+                self._log_unsuccessful_geoquery(business, contour_txt)
+
+    def _log_unsuccessful_geoquery(self, business, contour_txt):
+        self.__unsuccessful_geoqueries.append(collections.OrderedDict([
+            ("image", os.path.basename(business.image_file)), ("name", business.name),
+            ("address", business.address), ("city", business.city), ("zip", business.zip),
+            ("contour_text", contour_txt.strip())]))
+
+    def format_geoquery_log(self):
+        """
+        returns the unsuccessful geo-queries logged since the last call as json lines
+        (one object with image, name, address, city, zip and contour_text per line) and clears them
+        """
+
+        failures = self.__unsuccessful_geoqueries
+        self.__unsuccessful_geoqueries = []
+
+        return "".join(json.dumps(failure) + "\n" for failure in failures)
+
+    def write_geoquery_log(self):
+        """append the unsuccessful geo-queries logged since the last call to the geoquery log"""
+
+        with open(self.geoquery_log_fn, "a") as file:
+            file.write(self.format_geoquery_log())
+
+    def _flush_geoquery_log(self):
+        """write the logged geo-queries unless the caller is buffering them (see buffer_geoquery_log)"""
+        if not self.buffer_geoquery_log:
+            self.write_geoquery_log()
+
+    def _spellcheck_contours(self, contours):
+        """correct the spelling of the words (longer than 3 characters) in the text of contours, all in one batch"""
+
+        contours = list(contours)
+
+        # words are at the even indices, the whitespace between them at the odd ones
+        split_texts = [re.split(r"(\s+)", contour.text) for contour in contours]
+
+        corrections = self._spell_checker.correct_many(word for parts in split_texts for word in parts[::2] if len(word) > 3)
+
+        for contour, parts in itertools.izip(contours, split_texts):
+            parts[::2] = [corrections[word][0] if len(word) > 3 else word for word in parts[::2]]
+            contour.text = "".join(parts)
+
+    def _get_city_lines(self, call_args):
+        """
+        override this to return the lines of a page that _process_contour() will match to cities,
+        they are matched in one batch before its contours are processed (see _match_to_city())
+        :param call_args: the list of argument tuples returned by _define_contour_call_args()
+        """
+        return []
+
+    def _match_to_city(self, line):
+        """match a line to a city (None if it isn't one), lines from _get_city_lines() have already been matched"""
+        if line in self._page_city_matches:
+            return self._page_city_matches[line]
+        return self._city_detector.match_to_cities(line)
 
     def _get_noncolumn_contours_of_interest(self, noncolumn_contours):
         """
@@ -363,13 +834,17 @@ class RegistryProcessor(object):
 
     def remove_geoquery_log(self):
         """if this isn't called the existing file will simply be appended to"""
-        if (os.path.exists(self._geoquery_log_fn)):
-            os.remove(self._geoquery_log_fn)
+        if (os.path.exists(self.geoquery_log_fn)):
+            os.remove(self.geoquery_log_fn)
 
     def total_ocr_confidence(self):
         """returns (total confidence, number of words) for getting an average over multiple runs"""
         return (self.__ocr_confidence_sum, self.__num_words)
 
+    def city_cache_hits_and_misses(self):
+        """returns (hits, misses) of the city detector's match cache for getting a hit rate over multiple runs"""
+        return (self._city_detector.cache_hits, self._city_detector.cache_misses)
+
     def mean_ocr_confidence(self):
         """returns mean confidence so far or -1 if OCR has not been used yet"""
         return self.__ocr_confidence_sum * 1.0 / self.__num_words if self.__num_words > 0 else -1
@@ -402,6 +877,7 @@ class RegistryProcessor(object):
         self.__num_geo_successes = 0
         self.__num_geo_attempts = 0
         self.__per_image_business_counts = []
+        self._city_detector.reset_cache_stats()
 
     def load_from_tsv(self, path):
         """load self.businesses from a tsv file where they were previously saved"""
@@ -418,7 +894,11 @@ class RegistryProcessor(object):
                     [business.category, business.name, business.address,
                      business.city, business.zip, business.emp, business.sales,
                      business.cat_desc, business.bracket, business.lat,
-                     business.long, business.confidence_score] = row
+                     business.long, business.confidence_score] = row[:12]
+
+                    # older files don't have the image file column
+                    if len(row) > 12:
+                        business.image_file = row[12]
 
                     # cast to float
                     business.confidence_score = float(business.confidence_score)
@@ -432,15 +912,26 @@ class RegistryProcessor(object):
         """record business registries to tsv, opened with file access mode: mode"""
 
         with open(path, mode) as file:
-            file_writer = csv.writer(file, delimiter ="\t")
+            file.write(self.format_tsv_records())
+
+    def format_tsv_records(self):
+        """
+        returns the text record_to_tsv() writes, override this to record something else
+        (i.e. so a single writer can record the results of many subprocesses)
+        """
+
+        buf = cStringIO.StringIO()
+        file_writer = csv.writer(buf, delimiter ="\t")
 
-            for business in self.businesses:
-                entry = [business.category, business.name, business.address,
-                         business.city, business.zip, business.emp, business.sales,
-                         business.cat_desc, business.bracket, business.lat, business.long,
-                         business.confidence_score, business.image_file]
+        for business in self.businesses:
+            entry = [business.category, business.name, business.address,
+                     business.city, business.zip, business.emp, business.sales,
+                     business.cat_desc, business.bracket, business.lat, business.long,
+                     business.confidence_score, business.image_file]
+
+            file_writer.writerow(entry)
 
-                file_writer.writerow(entry)
+        return buf.getvalue()
 
     def load_settings_from_cfg(self, path):
         # Set default values.
@@ -454,6 +945,7 @@ class RegistryProcessor(object):
                 'bb_expansion_percent': str(self.bb_expansion_percent), 
                 'indent_width': str(self.indent_width),
                 'std_thresh': str(self.std_thresh),
+                'contour_scale': str(self.contour_scale),
             })
         cp.read(path)
 
@@ -466,6 +958,7 @@ class RegistryProcessor(object):
         self.bb_expansion_percent = cp.getfloat('RegistryProcessor','bb_expansion_percent')
         self.indent_width = cp.getfloat('RegistryProcessor','indent_width')
         self.std_thresh = cp.getfloat('RegistryProcessor','std_thresh')
+        self.contour_scale = cp.getfloat('RegistryProcessor','contour_scale')
 
     def save_settings_to_cfg(self, path):
         cp = ConfigParser.SafeConfigParser()
@@ -480,30 +973,27 @@ class RegistryProcessor(object):
         cp.set('RegistryProcessor','bb_expansion_percent',str(self.bb_expansion_percent))
         cp.set('RegistryProcessor','indent_width',str(self.indent_width))
         cp.set('RegistryProcessor','std_thresh',str(self.std_thresh))
+        cp.set('RegistryProcessor','contour_scale',str(self.contour_scale))
 
         with open(path,'w') as cfg_file:
             cp.write(cfg_file)
 
-    def _remove_edge_contours(self, contours):
-        """remove contours that touch the edge of image
+    def _remove_edge_contours(self, contour_table):
+        """remove contours (rows of contour_table) that touch the edge of image
         and crops self._image and self._thresh to an
         appropriate size"""
 
-        filtered_contours = []
-
-        for contour in contours:
-            if (contour.x == 1 or contour.x + contour.w == self._image_width - 1) or \
-            (contour.y == 1 or contour.y + contour.h == self._image_height - 1):
-                continue
+        at_edge = (contour_table["x"] == 1) | (contour_table["x"] + contour_table["w"] == self._image_width - 1) | \
+                  (contour_table["y"] == 1) | (contour_table["y"] + contour_table["h"] == self._image_height - 1)
+        filtered_table = contour_table[~at_edge]
 
-            filtered_contours.append(contour)
-
-        if len(filtered_contours) == 0:
+        if len(filtered_table) == 0:
             raise RuntimeError("No non-background contours found, check debug images")
 
         # create cropped version of image
-        super_contour = np.concatenate([c.data for c in filtered_contours])
-        [x,y,w,h] = cv2.boundingRect(super_contour)
+        x, y = int(filtered_table["x"].min()), int(filtered_table["y"].min())
+        w = int((filtered_table["x"] + filtered_table["w"]).max()) - x
+        h = int((filtered_table["y"] + filtered_table["h"]).max()) - y
 
         # make bounding box bigger
         x,y,w,h = self._expand_bb(x,y,w,h)
@@ -512,41 +1002,69 @@ class RegistryProcessor(object):
         self.__thresh_image = self.__thresh_image[y:y + h, x:x + w]
 
         # apply cropping offset to contours
-        for c in contours:
-            c.x -= x
-            c.x_mid -= x
-            c.y -= y
-            c.y_mid -= y
-            # apply cropping offset to each point in contours
-            for p in c.data:
-                p[0][0] -= x
-                p[0][1] -= y
-
-        return filtered_contours
+        for name in ("x", "x_mid"):
+            filtered_table[name] -= x
+        for name in ("y", "y_mid"):
+            filtered_table[name] -= y
+
+        return filtered_table
 
     def _get_contours(self, make_new_thresh = True):
         """
         Performs a close operation to close gaps between letters to make solid contours,
         then performs an open operation to remove stray noise contours and returns the result
+        (on a copy of the thresh image scaled by contour_scale, the contours are scaled back to full size)
         :param make_new_thresh: if true this function will make a new thresh_image rather than using the existing self.__thresh_image
         :return: returns cv2 contour data (not wrapped in Contour() class)
         """
 
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, self.kernel_shape)
+        scale = self.contour_scale
 
         if make_new_thresh: # if asked then we make a new thresh image
-            if not self.assume_pre_processed:
-                _,self.__thresh_image = cv2.threshold(self.__image, self.thresh_value, 255, cv2.THRESH_BINARY_INV) # threshold
-            else:
-                _,self.__thresh_image = cv2.threshold(self.__image, 0, 255, cv2.THRESH_BINARY_INV) # threshold with 0 threshold value
+            thresh_value = self.thresh_value if not self.assume_pre_processed else 0 # pre processed images use a 0 threshold value
+
+            # the grayscale image is left as it is so a new thresh image can be made from it again
+            _,self.__thresh_image = cv2.threshold(self.__image, thresh_value, 255, cv2.THRESH_BINARY_INV) # threshold
+
+        if scale != 1.0:
+            closed = cv2.resize(self.__thresh_image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        else:
+            closed = self.__thresh_image
+
+        closed = close_and_open(closed, self.kernel_shape, self.iterations, scale)
+
+        contours = cv2.findContours(closed,cv2.RETR_EXTERNAL,cv2.CHAIN_APPROX_SIMPLE)[1] # actual contour data is the second element
+
+        if scale != 1.0:
+            # the second and second to last pixels of the scaled image are mapped onto those of the full image
+            # (_remove_edge_contours() looks for contours there) and the rest are scaled between them
+            small_max = np.array(closed.shape[::-1]) - 1 # last x and y of each image
+            full_max = np.array(self.__thresh_image.shape[::-1]) - 1
+            factors = (full_max - 2.0) / np.maximum(1, small_max - 2)
 
-        # close operation to fill contours
-        closed = cv2.morphologyEx(self.__thresh_image, cv2.MORPH_CLOSE, kernel, iterations = self.iterations)
+            # add the shift of an even sized full scale kernel so the contours match the full scale ones
+            shift = np.array([self.iterations + self.iterations / 3 if k % 2 == 0 else 0 for k in self.kernel_shape])
 
-        # perform an open operation to remove noise
-        closed = cv2.morphologyEx(closed,cv2.MORPH_OPEN,kernel,iterations = self.iterations / 3)
+            def scale_up(c):
+                full_c = np.clip(np.round(1 + (c - 1) * factors + shift), 1, full_max - 1)
 
-        return cv2.findContours(closed,cv2.RETR_EXTERNAL,cv2.CHAIN_APPROX_SIMPLE)[1] # actual contour data is the second element
+                # points on (or next to) the border aren't shifted off of it, like at full scale
+                full_c = np.where(c <= 1, c, full_c)
+                full_c = np.where(c >= small_max - 1, full_max - (small_max - c), full_c)
+
+                return full_c.astype(np.int32)
+
+            contours = [scale_up(c) for c in contours]
+
+        return contours
+
+    def _get_contour_table(self, make_new_thresh = True):
+        """
+        find the bounding boxes of the contours _get_contours() finds (all that's needed of them from here on)
+        :param make_new_thresh: if true this function will make a new thresh_image rather than using the existing self.__thresh_image
+        :return: contour table (see contour_dtype)
+        """
+        return contour_table_from_contours(self._get_contours(make_new_thresh))
 
     def _find_column_locations(self, contours):
         """find column column locations, and page boundary if two pages
@@ -554,20 +1072,21 @@ class RegistryProcessor(object):
 
         # create array of coords for left and right edges of contours
         coords = [[contour.x, contour.x + contour.w] for contour in contours]
-        coords_arr = np.array(coords)
+        coords_arr = np.array(coords, dtype=float)
 
-        # use k-means clustering to get column boundaries for expected # of cols
         num_cols = self.columns_per_page * self.pages_per_image
-        k_means = KMeans(n_clusters=num_cols)
 
         if len(coords_arr) < num_cols:
             raise RuntimeError("Number of contours detected fewer than number of expected columns")
 
-        clustering = k_means.fit(coords_arr)
+        if self.column_detection == "gaps":
+            clustering = self._find_columns_by_gaps(coords_arr, num_cols)
+        else:
+            clustering = self._find_columns_by_kmeans(coords_arr, num_cols)
 
         self.page_boundary = -1
         if self.pages_per_image == 2:  # if there are two pages find the page boundary
-            sorted_cols = sorted(clustering)
+            sorted_cols = sorted(clustering.cluster_centers_.tolist())
             self.page_boundary = (sorted_cols[self.columns_per_page - 1][0] +
                                   sorted_cols[self.columns_per_page][0]) / (2 * 1.0)
 
@@ -602,46 +1121,160 @@ class RegistryProcessor(object):
 
         return clustering
 
+    def _find_columns_by_kmeans(self, coords, num_cols):
+        """use k-means clustering to get column boundaries for expected # of cols"""
+        return KMeans(n_clusters=num_cols).fit(coords)
+
+    def _find_columns_by_gaps(self, coords, num_cols):
+        """
+        refine the previous image's columns (pages of a registry barely move) and splits of the contours
+        at the num_cols - 1 widest gaps between their left edges and between their midpoints with a few
+        k-means iterations each and keep the best, sklearn's KMeans is only used if none give consistent columns
+        """
+        starts = []
+        for xs in (coords[:, 0], coords.mean(axis=1)):
+            order = np.argsort(xs, kind="mergesort")
+            splits = np.sort(np.argsort(np.diff(xs[order]), kind="mergesort")[len(xs) - num_cols:]) + 1
+            starts.append(np.array([coords[group].mean(axis=0) for group in np.split(order, splits)]))
+
+        previous = self.__previous_column_centers
+        if previous is not None and len(previous) == num_cols:
+            starts.append(previous)
+
+        clusterings = [ColumnClustering.fit(coords, centers) for centers in starts]
+        clusterings = [c for c in clusterings if c is not None and c.is_consistent()]
+
+        if len(clusterings) > 0:
+            clustering = min(clusterings, key=attrgetter("inertia_"))
+        else:
+            clustering = self._find_columns_by_kmeans(coords, num_cols)
+
+        self.__previous_column_centers = clustering.cluster_centers_
+        return clustering
+
     def _make_contour_columns(self, contours, clustering):
         """makes contour columns based on column locations
            return: contour_columns, noncolumn_contours
            (column contours are sorted by column and position)"""
 
-        column_contours = []
-        non_column_contours = []
+        labels = np.asarray(clustering.labels_)
+        col_locs = np.asarray(clustering.cluster_centers_)
+
+        # x-coords and y-coord of contours
+        contour_locs = np.array([[c.x, c.x + c.w] for c in contours], dtype=float).reshape(-1, 2)
+        contour_ys = np.array([c.y for c in contours])
 
-        # sort contours by clusters
-        cluster_groups = sorted(zip(clustering.labels_, contours))
+        # columns that have contours, in order of position
+        col_ixs = sorted(np.unique(labels), key=lambda col_ix: col_locs[col_ix][0])
 
-        # iterate through column groups, deciding which contours are valid
-        for col_ix, cluster_group in itertools.groupby(cluster_groups, lambda x: x[0]):
+        # calculate standard deviation of contour x-coords of each column
+        col_stds = np.zeros(len(col_locs))
+        for col_ix in col_ixs:
+            col_stds[col_ix] = np.std(contour_locs[labels == col_ix])
 
-            # coords of column
-            col_loc = clustering.cluster_centers_[col_ix]
+        # only keep contours if less than threshold std devs from column
+        dists = np.sqrt(((contour_locs - col_locs[labels]) ** 2).sum(axis=1))
+        keep = dists < self.std_thresh * col_stds[labels]
 
-            cluster_contours = [c for _, c in cluster_group]
+        # sort contours of each column by position
+        sorted_column_contours = []
+        for col_ix in col_ixs:
+            keep_ixs = np.flatnonzero(keep & (labels == col_ix))
+            keep_ixs = keep_ixs[np.argsort(contour_ys[keep_ixs], kind="mergesort")]
+            sorted_column_contours.append([contours[ix] for ix in keep_ixs])
+
+        # the rest grouped by column
+        non_column_ixs = np.flatnonzero(~keep)
+        non_column_ixs = non_column_ixs[np.argsort(labels[non_column_ixs], kind="mergesort")]
+        non_column_contours = [contours[ix] for ix in non_column_ixs]
 
-            # x-coords of contours
-            contour_locs = [[c.x, c.x + c.w] for c in cluster_contours]
-            # calculate standard deviation of contour x-coords
-            col_std = np.std(contour_locs)
+        return sorted_column_contours, non_column_contours
 
-            # only keep contours if less than threshold std devs from column
-            keep_contours = []
-            for contour_ix, contour in enumerate(cluster_contours):
-                dist = abs(np.linalg.norm(contour_locs[contour_ix] - col_loc))
-                if dist < self.std_thresh * col_std:
-                    keep_contours.append(contour)
+def benchmark_contour_scales(reg_processor, path, scales=(1.0, 0.5, 0.25)):
+    """
+    time _get_contours() on the image at path with each RegistryProcessor.contour_scale in scales
+    and compare the bounding boxes of the contours to those found at full scale, for benchmarking purposes
+    :return: list of (scale, seconds, number of contours, mean best overlap with a full scale contour) tuples,
+             overlap is intersection over union of the bounding boxes (1 is identical)
+    """
+    results = []
+    original_scale = reg_processor.contour_scale
+
+    def overlap(a, b):
+        w = min(a.x + a.w, b.x + b.w) - max(a.x, b.x)
+        h = min(a.y + a.h, b.y + b.h) - max(a.y, b.y)
+        intersection = max(0, w) * max(0, h)
+        return intersection * 1.0 / (a.w * a.h + b.w * b.h - intersection)
+
+    try:
+        full_contours = None
+        for scale in (1.0,) + tuple(s for s in scales if s != 1.0):
+            reg_processor.contour_scale = scale
+            reg_processor._load_image(path)
+
+            start_time = time.time()
+            contours = [Contour(c) for c in reg_processor._get_contours(make_new_thresh = True)]
+            elapsed = time.time() - start_time
+
+            if full_contours is None:
+                full_contours = contours
+
+            if len(full_contours) > 0 and len(contours) > 0:
+                mean_overlap = sum(max(overlap(f, c) for c in contours) for f in full_contours) / len(full_contours)
+            else:
+                mean_overlap = 0.0
+
+            if scale in scales:
+                results.append((scale, elapsed, len(contours), mean_overlap))
+                print "scale %f: %f sec, %d contours, mean overlap %f" % results[-1]
+    finally:
+        reg_processor.contour_scale = original_scale
+
+    return results
+
+def benchmark_column_detection(reg_processor, image_paths):
+    """
+    time finding the columns of each image in image_paths (in order, so "gaps" can start from the previous
+    image's columns) with each RegistryProcessor.column_detection and compare the columns each contour is
+    put in, for benchmarking purposes
+    :return: (kmeans seconds per image, gaps seconds per image, fraction of contours put in the same column)
+    """
+    kmeans_time = gaps_time = 0.0
+    num_contours = num_agreements = 0
+    original_detection = reg_processor.column_detection
+
+    # columns are compared by position since their labels are in no particular order
+    def column_positions(clustering):
+        return np.argsort(np.argsort(clustering.cluster_centers_[:, 0]))[clustering.labels_]
+
+    try:
+        for path in image_paths:
+            reg_processor._load_image(path)
+            contour_table = reg_processor._get_contour_table(make_new_thresh = True)
+            if not reg_processor.assume_pre_processed:
+                contour_table = reg_processor._remove_edge_contours(contour_table)
+            contours = [Contour.from_table_row(row) for row in contour_table]
+
+            positions = []
+            for detection in ("kmeans", "gaps"):
+                reg_processor.column_detection = detection
+
+                start_time = time.time()
+                clustering = reg_processor._find_column_locations(contours)
+                elapsed = time.time() - start_time
+
+                if detection == "kmeans":
+                    kmeans_time += elapsed
                 else:
-                    non_column_contours.append(contour)
+                    gaps_time += elapsed
+                positions.append(column_positions(clustering))
 
-            column_contours.append(keep_contours)
+            num_contours += len(contours)
+            num_agreements += int((positions[0] == positions[1]).sum())
+    finally:
+        reg_processor.column_detection = original_detection
 
-        # sort column and contour by position
-        sorted_column_contours = []
-        sorted_columns = sorted(enumerate(column_contours),key=lambda x: 
-                                 clustering.cluster_centers_[x[0]][0])
-        for i, column in sorted_columns:
-            sorted_column_contours.append(sorted(column,key=attrgetter('y')))
+    results = (kmeans_time / len(image_paths), gaps_time / len(image_paths), num_agreements * 1.0 / num_contours)
+    print "kmeans: %f sec/image, gaps: %f sec/image, %f of contours in the same column" % results
 
-        return sorted_column_contours, non_column_contours
+    return results
@@ -6,7 +6,6 @@ import os.path
 import re
 import numpy as np
 import registry_processor as reg
-import business_geocoder as geo
 from operator import itemgetter, attrgetter
 
 class RegistryProcessorNew(reg.RegistryProcessor):
@@ -30,7 +29,6 @@ class RegistryProcessorNew(reg.RegistryProcessor):
             business = self._parse_registry_block(contour_txt)
             business.category = self.current_sic
 
-            geo.geocode_business(business)
             return business
         elif sic_match:
             self.current_sic = sic_match.group(0)
@@ -46,10 +44,9 @@ class RegistryProcessorNew(reg.RegistryProcessor):
         business.name = lines[0]
         business.address = lines[1]
 
-        match = self.city_pattern.search(registry_txt)
-        if match:
-            city = match.group(0)
-            match_city = self._city_detector.match_to_cities(city) # perform spell check and confirm this is a city
+        city = self._find_city(registry_txt)
+        if city:
+            match_city = self._match_to_city(city) # perform spell check and confirm this is a city
             if match_city:
                 if match_city != city:
                     print("Imperfect city match: %s matched to %s" % (city, match_city))
@@ -63,6 +60,15 @@ class RegistryProcessorNew(reg.RegistryProcessor):
 
         return business
 
+    def _find_city(self, registry_txt):
+        """returns the city of a registry block's text (None if there isn't one)"""
+        match = self.city_pattern.search(registry_txt)
+        return match.group(0) if match else None
+
+    def _get_city_lines(self, call_args):
+        cities = [self._find_city(contour_txt) for contour_txt, _ in call_args if self.registry_pattern.match(contour_txt)]
+        return [city for city in cities if city]
+
 class RegistryRecorder(RegistryProcessorNew):
     def __init__(self):
         super(RegistryRecorder, self).__init__()
@@ -97,9 +103,12 @@ class RegistryRecorder(RegistryProcessorNew):
             self.registry_txt += "\n" + self._end(self.bus_prefix) + "\n"
 
         return reg.Business()
-    def record_to_tsv(self, path, mode='w'):
-        with open(path, mode) as file:
-            file.write(self.registry_txt)
+
+    def _get_city_lines(self, call_args):
+        return [] # cities aren't recorded
+
+    def format_tsv_records(self):
+        return self.registry_txt
 
 class RegistryProcessorOld(reg.RegistryProcessor):
     """Pre-1975 RI registry parser."""
@@ -124,24 +133,31 @@ class RegistryProcessorOld(reg.RegistryProcessor):
             if len(self.current_zip) > 0:
                 business.zip = self.current_zip
 
-            geo.geocode_business(business)
             return business
         else:  # check if city header
-            segments = contour_txt.rpartition(" ")
-            zip = ""
+            contour_txt, zip = self._split_zip(contour_txt)
 
-            # check if zip is in header
-            if segments[2].isdigit() and len(segments[2]) == 5:
-                zip = segments[2]
-                contour_txt = segments[0]
-
-            match_city = self._city_detector.match_to_cities(contour_txt)
+            match_city = self._match_to_city(contour_txt)
 
             if match_city:
                 self.current_city = match_city
                 self.current_zip = zip
         return reg.Business()
 
+    @staticmethod
+    def _split_zip(header_txt):
+        """split a city header into its city and zip code (empty if the header has no zip)"""
+        segments = header_txt.rpartition(" ")
+
+        # check if zip is in header
+        if segments[2].isdigit() and len(segments[2]) == 5:
+            return segments[0], segments[2]
+        return header_txt, ""
+
+    def _get_city_lines(self, call_args):
+        # single line contours are city headers (see _process_contour())
+        return [self._split_zip(contour_txt)[0] for contour_txt, _, _ in call_args if contour_txt.count("\n") == 0]
+
     def _parse_registry_block(self, registry_txt):
         """works for registries from 1953-1975"""
 
@@ -218,6 +234,9 @@ class RegistryProcessorOld(reg.RegistryProcessor):
 
         business_groups = []
 
+        # registries under a header are found with a binary search of each column
+        sorted_columns = [reg.SortedContours(column) for column in column_contours]
+
         # put non-headers (business registries) into business groups
         for i, header in enumerate(header_contours):
             next_header = None
@@ -236,14 +255,9 @@ class RegistryProcessorOld(reg.RegistryProcessor):
             # if next header exists and is on same page: True
             nxt_hdr_on_same_page = next_header and on_same_page(header,next_header)
 
-            bus_group_columns = [] # contains registries
-            for i in range(0, self.columns_per_page):
-                bus_group_columns.append([])
-
-            for i, column in enumerate(column_contours[column_start:column_end]):
-                for registry in column:
-                    if registry.y > header.y and (not nxt_hdr_on_same_page or registry.y < next_header.y):
-                        bus_group_columns[i].append(registry)
+            # registries below the header (and above the next one if it's on the same page)
+            bottom = next_header.y if nxt_hdr_on_same_page else None
+            bus_group_columns = [column.between(header.y, bottom) for column in sorted_columns[column_start:column_end]]
 
             business_groups.append(itertools.chain.from_iterable(bus_group_columns))
 
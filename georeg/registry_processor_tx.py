@@ -53,38 +53,27 @@ class RegistryProcessorOldTX(RegistryProcessorTX):
 
         for c in contours:
             contour = reg.Contour(c)
-            left_aligned = False
-            y_top = contour.y # Top of the contour split.
-            y_bottom = contour.y + contour.h # Bottom of the contour split.
-            y_max = y_bottom - 1
+            y_max = contour.y + contour.h - 1 # Bottom of the contour.
             x_indent = contour.x + (contour.w * self.indent_width) # indent x coord
             x_max = contour.x + contour.w
-            start_splits = False # don't start contour splits until hitting a left indent
-
-            # assumes counter-clockwise movement from top-left
-            for [[x, y]] in contour.data:
-                if y == y_max:
-                    # add contour from the last top coord to bottom of contour
-                    rect = generate_rect(contour.x, x_max, y_top, y_max)
-                    split_contours.append(rect)
-                    break
-                if left_aligned:
-                    start_splits = True
-                    if x > x_indent:
-                        # Mark that coordinates are indented.
-                        left_aligned = False
-                elif x <= x_indent:
-                    # Mark that coordinates no longer indented.
-                    left_aligned = True
-                    if start_splits:
-                        # Set y as bottom of block.
-                        y_bottom = y
-                        # Create rect from last block to this one.
-                        rect = generate_rect(contour.x, x_max, y_top, y_bottom)
-                        # Append to contours.
-                        split_contours.append(rect)
-                        # Set y as top of next block.
-                        y_top = y
+
+            # assumes counter-clockwise movement from top-left,
+            # so the left edge is walked until reaching the bottom of the contour
+            points = contour.data[:, 0]
+            at_bottom = np.flatnonzero(points[:, 1] == y_max)
+            if len(at_bottom) == 0:
+                continue
+            points = points[:at_bottom[0]]
+
+            # the left edge comes back to the left margin after each indent,
+            # a new block starts there (the first time is the top of the contour)
+            left_aligned = points[:, 0] <= x_indent
+            returns = np.flatnonzero(left_aligned & ~np.r_[False, left_aligned[:-1]])
+            split_ys = points[returns[1:], 1].tolist()
+
+            # Create a rect for each block, the last ending at the bottom of contour.
+            for y_top, y_bottom in zip([contour.y] + split_ys, split_ys + [y_max]):
+                split_contours.append(generate_rect(contour.x, x_max, y_top, y_bottom))
 
         return split_contours
 
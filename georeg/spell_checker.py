@@ -2,6 +2,16 @@ import nltk
 import re
 import csv
 import os
+import sys
+import mmap
+import struct
+import zlib
+import bisect
+import itertools
+import threading
+import time
+import multiprocessing
+import numpy as np
 from Levenshtein import distance
 
 import exceptions
@@ -44,37 +54,391 @@ class Token(object): # a "word" in our spellcheck dictionary
 
         self.similar_tokens = set([])
 
-    def touched_by(self, id):
-        try:
-            if id == self._touch_id: return True
-            else: return False
-        except AttributeError:
-            return False
 
-    def touch_with(self, id):
-        self._touch_id = id
+def _deletes(word, max_deletes):
+    """returns the set of strings made by deleting up to max_deletes characters from word (including word)"""
+    deletes = set([word])
+    last_deletes = [word]
 
-    def remove_touch_id(self):
-        try:
-            del self._touch_id
-        except AttributeError:
-            pass
+    for _ in xrange(max_deletes):
+        next_deletes = []
+        for d in last_deletes:
+            for i in xrange(len(d)):
+                new_d = d[:i] + d[i + 1:]
+                if new_d not in deletes:
+                    deletes.add(new_d)
+                    next_deletes.append(new_d)
+        last_deletes = next_deletes
+
+    return deletes
+
+class DeletionIndex(object):
+    """
+    SymSpell style index of words, every string made by deleting up to max_deletes characters
+    from a word maps back to the word, any word within max_deletes edits of a query shares at least
+    one of these deletes with it so close matches are found with a few dictionary lookups
+    instead of comparing the query against every word.
+    Lookups keep all of their state locally so any number of threads can search the same index
+    at once (but not while words are being added)
+    """
+    def __init__(self, max_deletes=2):
+        self.max_deletes = max_deletes
+
+        self._words = [] # word id -> word
+        self._deletes = {} # delete string -> list of word ids
+        self._words_by_len = {} # word length -> list of word ids (for matches further than max_deletes edits away)
+
+    def __len__(self):
+        return len(self._words)
+
+    def add(self, word):
+        """add a word to the index (words must only be added once)"""
+        word = unicode(word)
+        ix = len(self._words)
+
+        self._words.append(word)
+        self._words_by_len.setdefault(len(word), []).append(ix)
+
+        for d in _deletes(word, self.max_deletes):
+            self._deletes.setdefault(d, []).append(ix)
+
+    def find_most_similar(self, word, min_similarity, target_similarity=100):
+        """
+        Finds the word with the highest ratio() to word
+        :param word: the string to be matched
+        :param min_similarity: only words with at least this similarity are considered
+        :param target_similarity: a similarity score that will stop the search once reached
+        :return: a tuple with the match and score as a percent i.e. (match, score) or (None, 0) if nothing matched
+        """
+
+        word = unicode(word)
+        word_len = len(word)
+
+        best = [None, 0] # [word, score]
+        compared = bytearray(len(self)) # flags of the word ids this search has compared already
+
+        def compare(ix, candidate):
+            """compare candidate to word, return True if the search can stop"""
+            compared[ix] = 1
+
+            max_len = max(word_len, len(candidate))
+            score = (1.0 - distance(word, candidate) * 1.0 / max_len) * 100.0 if max_len > 0 else 100.0
+
+            if score >= min_similarity and score > best[1]:
+                best[0], best[1] = candidate, score
+
+            return best[1] >= target_similarity
+
+        # first check every word within max_deletes edits
+        for d in _deletes(word, self.max_deletes):
+            for ix, candidate in self._words_with_delete(d):
+                if not compared[ix] and compare(ix, candidate):
+                    return tuple(best)
+
+        # a word with a similarity of at least min_sim can be no more than this many edits away from word
+        # (the longer word sets the ratio's denominator and is at most len(word) + dist long)
+        min_sim = max(min_similarity, best[1])
+        if min_sim > 0:
+            max_dist = int(word_len * (100.0 - min_sim) / min_sim + 1e-9) # allow for rounding error
+        else:
+            max_dist = sys.maxint
+
+        # only if a better word could be further away than max_deletes edits do we have to
+        # look at the rest of the words (lengths of words differ by at most their edit distance)
+        if max_dist > self.max_deletes:
+            for ix, candidate in self._words_with_lengths(word_len - max_dist, word_len + max_dist):
+                if not compared[ix] and compare(ix, candidate):
+                    return tuple(best)
+
+        return tuple(best)
+
+    def _words_with_delete(self, d):
+        """returns (id, word) pairs of the words that d is a delete of"""
+        return ((ix, self._words[ix]) for ix in self._deletes.get(d, ()))
+
+    def _words_with_lengths(self, min_len, max_len):
+        """returns (id, word) pairs of the words between min_len and max_len characters long"""
+        ids = itertools.chain.from_iterable(ids for length, ids in self._words_by_len.iteritems()
+                                            if min_len <= length <= max_len)
+        return ((ix, self._words[ix]) for ix in ids)
+
+
+class MappedDictionary(object):
+    """
+    Read-only spell checker dictionary stored in a memory mapped file (see SpellChecker.write_dictionary_to_bin),
+    tokens are strings sorted by length in one buffer with their counts in an array and their similar tokens as
+    CSR style offsets into an array of token ids, so any number of processes can share the same pages.
+    Behaves like the token dictionary of SpellChecker (Token objects are created on access)
+    """
+
+    _magic = "GRSPELL1"
+    _header = struct.Struct("<8sqqq")
+    # (name, dtype) of each array in the order they are stored
+    _arrays = [("word_offsets", np.int32), ("word_table", np.int32), ("counts", np.int64),
+               ("similar_offsets", np.int32), ("similar_ids", np.int32),
+               ("delete_offsets", np.int32), ("delete_table", np.int32),
+               ("delete_id_offsets", np.int32), ("delete_ids", np.int32),
+               ("lengths", np.int32),
+               ("words", np.uint8), ("deletes", np.uint8)]
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.__open()
+
+    def __getstate__(self):
+        # the file is mapped again when unpickled rather than copied
+        return {"file_name": self.file_name}
+
+    def __setstate__(self, state):
+        self.file_name = state["file_name"]
+        self.__open()
+
+    def __open(self):
+        with open(self.file_name, "rb") as file:
+            self._mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.similarity_thresh, self.total_occurrences, self.max_deletes = \
+            self._header.unpack_from(self._mm, 0)
+
+        if magic != self._magic:
+            raise RuntimeError("dictionary file \"%s\" is not a binary spell checker dictionary" % self.file_name)
+
+        offset = self._header.size
+        sizes = struct.unpack_from("<%dq" % len(self._arrays), self._mm, offset)
+        offset += 8 * len(self._arrays)
+
+        for (name, dtype), size in zip(self._arrays, sizes):
+            setattr(self, "_" + name, np.frombuffer(self._mm, dtype, size, offset))
+
+            # strings are sliced straight from the map so we need to know where they start
+            if dtype is np.uint8:
+                setattr(self, "_%s_start" % name, offset)
+
+            offset += _padded(size * np.dtype(dtype).itemsize)
+
+    @classmethod
+    def write(cls, file_name, tokens, similarity_thresh, total_occurrences, max_deletes):
+        """write a dictionary of Token objects to file_name in the format MappedDictionary reads"""
+
+        # sorting by length makes the words of any range of lengths contiguous
+        words = sorted((str(w) for w in tokens), key=lambda w: (len(w), w))
+        ids = dict((w, ix) for ix, w in enumerate(words))
+
+        word_offsets = np.cumsum([0] + [len(w) for w in words])
+        counts = [tokens[w].count for w in words]
+
+        similar_ids = [sorted(ids[str(t.value)] for t in tokens[w].similar_tokens) for w in words]
+        similar_offsets = np.cumsum([0] + [len(l) for l in similar_ids])
+
+        # deletion index of the words (see DeletionIndex)
+        deletes = {}
+        for ix, w in enumerate(words):
+            for d in _deletes(unicode(w), max_deletes):
+                deletes.setdefault(str(d), []).append(ix)
+        delete_strs = sorted(deletes)
+        delete_offsets = np.cumsum([0] + [len(d) for d in delete_strs])
+        delete_id_offsets = np.cumsum([0] + [len(deletes[d]) for d in delete_strs])
+
+        arrays = {"word_offsets": word_offsets, "word_table": _hash_table(words), "counts": counts,
+                  "similar_offsets": similar_offsets, "similar_ids": list(itertools.chain.from_iterable(similar_ids)),
+                  "delete_offsets": delete_offsets, "delete_table": _hash_table(delete_strs),
+                  "delete_id_offsets": delete_id_offsets,
+                  "delete_ids": list(itertools.chain.from_iterable(deletes[d] for d in delete_strs)),
+                  "lengths": [len(w) for w in words],
+                  "words": np.frombuffer("".join(words), np.uint8),
+                  "deletes": np.frombuffer("".join(delete_strs), np.uint8)}
+        arrays = [np.asarray(arrays[name], dtype) for name, dtype in cls._arrays]
+
+        with open(file_name, "wb") as file:
+            file.write(cls._header.pack(cls._magic, similarity_thresh, total_occurrences, max_deletes))
+            file.write(struct.pack("<%dq" % len(arrays), *[len(a) for a in arrays]))
+
+            for a in arrays:
+                data = a.tostring()
+                file.write(data + "\0" * (_padded(len(data)) - len(data)))
+
+    def __len__(self):
+        return len(self._counts)
+
+    def __contains__(self, word):
+        return self._id(word) != -1
+
+    def __getitem__(self, word):
+        ix = self._id(word)
+        if ix == -1:
+            raise KeyError(word)
+        return MappedToken(self, ix)
+
+    def iterkeys(self):
+        return (self._word(ix) for ix in xrange(len(self)))
+
+    def itervalues(self):
+        return (MappedToken(self, ix) for ix in xrange(len(self)))
+
+    def values(self):
+        return list(self.itervalues())
+
+    def _word(self, ix):
+        start = self._words_start
+        return self._mm[start + int(self._word_offsets[ix]):start + int(self._word_offsets[ix + 1])]
+
+    def _words_in_range(self, start_ix, end_ix):
+        """the words with ids in [start_ix, end_ix), read with a single slice of the map"""
+        offsets = self._word_offsets[start_ix:end_ix + 1].tolist()
+        buf = self._mm[self._words_start + offsets[0]:self._words_start + offsets[-1]]
+        return [buf[offsets[i] - offsets[0]:offsets[i + 1] - offsets[0]] for i in xrange(end_ix - start_ix)]
+
+    def _id(self, word):
+        """id of word or -1 if it isn't in the dictionary"""
+        return _find_string(self._mm, self._words_start, self._word_offsets, self._word_table, str(word))
+
+    def _similar_token_ids(self, ix):
+        return self._similar_ids[self._similar_offsets[ix]:self._similar_offsets[ix + 1]]
+
+    def _ids_with_delete(self, d):
+        ix = _find_string(self._mm, self._deletes_start, self._delete_offsets, self._delete_table, str(d))
+        if ix == -1:
+            return ()
+        return self._delete_ids[self._delete_id_offsets[ix]:self._delete_id_offsets[ix + 1]].tolist()
+
+    def _id_range_with_lengths(self, min_len, max_len):
+        """[start, end) range of the ids of words between min_len and max_len characters long"""
+        start, end = np.searchsorted(self._lengths, [min_len, max_len + 1])
+        return int(start), int(end)
+
+
+class MappedToken(Token):
+    """a token of a MappedDictionary, its similar tokens are looked up when accessed"""
+    def __init__(self, dictionary, id):
+        self.value = dictionary._word(id)
+        self.count = int(dictionary._counts[id])
+
+        self._dictionary = dictionary
+        self._id = id
+
+    def __eq__(self, other):
+        return isinstance(other, MappedToken) and self._dictionary is other._dictionary and self._id == other._id
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._id)
+
+    @property
+    def similar_tokens(self):
+        return set(MappedToken(self._dictionary, ix) for ix in self._dictionary._similar_token_ids(self._id))
+
+
+class MappedDeletionIndex(DeletionIndex):
+    """the DeletionIndex stored in a MappedDictionary"""
+    def __init__(self, dictionary):
+        super(MappedDeletionIndex, self).__init__(dictionary.max_deletes)
+        self._dictionary = dictionary
+
+    def __len__(self):
+        return len(self._dictionary)
+
+    def add(self, word):
+        raise RuntimeError("memory mapped dictionaries are read-only")
+
+    def _words_with_delete(self, d):
+        return ((ix, unicode(self._dictionary._word(ix))) for ix in self._dictionary._ids_with_delete(d))
+
+    def _words_with_lengths(self, min_len, max_len):
+        start, end = self._dictionary._id_range_with_lengths(min_len, max_len)
+        return ((ix, unicode(w)) for ix, w in enumerate(self._dictionary._words_in_range(start, end), start))
+
+
+def _padded(size):
+    """size rounded up to a multiple of 8 bytes"""
+    return (size + 7) // 8 * 8
+
+def _hash_table(strings):
+    """open addressing hash table (with linear probing) of the indices of strings, empty slots are -1"""
+
+    table = np.full(2 ** int(np.ceil(np.log2(2 * len(strings) + 1))), -1, np.int32)
+    mask = len(table) - 1
+
+    for ix, string in enumerate(strings):
+        slot = zlib.crc32(string) & mask
+        while table[slot] != -1:
+            slot = (slot + 1) & mask
+        table[slot] = ix
+
+    return table
+
+def _find_string(buf, start, offsets, table, key):
+    """index of key in the strings stored in buf at start + offsets (hashed by _hash_table()) or -1 if it isn't there"""
+
+    mask = len(table) - 1
+    slot = zlib.crc32(key) & mask
+
+    while True:
+        ix = int(table[slot])
+        if ix == -1:
+            return -1
+        if buf[start + int(offsets[ix]):start + int(offsets[ix + 1])] == key:
+            return ix
+        slot = (slot + 1) & mask
+
+def _similar_pairs(words, lengths, char_counts, is_new, similarity_thresh, rows):
+    """
+    Finds every pair of words with a ratio() of at least similarity_thresh that includes one of rows,
+    pairs of two old words (is_new is False) are skipped since they are already known
+    :param words: list of words sorted by length
+    :param lengths: array of the words' lengths
+    :param char_counts: 2d array with a row of character counts for each word
+    :param is_new: bool array, True for words that are new to the dictionary
+    :param similarity_thresh: the minimum similarity ratio of a pair
+    :param rows: indices of new words to find pairs for
+    :return: list of index tuples (i, j) where i is one of rows
+    """
+
+    pairs = []
+    max_dist_frac = (100.0 - similarity_thresh) / 100.0 + 1e-9 # allow for rounding error
+
+    for i in rows:
+        # the edit distance between two words is at least the difference in their lengths,
+        # so only words within this length range can be similar enough
+        if similarity_thresh > 0:
+            start = bisect.bisect_left(lengths, lengths[i] * (1.0 - max_dist_frac))
+            end = bisect.bisect_right(lengths, lengths[i] / (1.0 - max_dist_frac))
+        else:
+            start, end = 0, len(words)
+
+        # it is also at least the number of characters one word has that the other doesn't,
+        # which works out to half of the summed character count differences plus the length difference
+        char_diffs = np.abs(char_counts[start:end] - char_counts[i]).sum(1)
+        lower_bounds = (char_diffs + np.abs(lengths[start:end] - lengths[i])) / 2
+        max_lens = np.maximum(lengths[start:end], lengths[i])
+
+        candidates = np.flatnonzero(lower_bounds <= max_lens * max_dist_frac) + start
+
+        # each pair of new words only needs to be found once
+        candidates = candidates[~is_new[candidates] | (candidates < i)]
+
+        word = words[i]
+        for j, max_len in zip(candidates.tolist(), max_lens[candidates - start].tolist()):
+            # same as ratio() without the type conversions
+            if (1.0 - distance(word, words[j]) * 1.0 / max_len) * 100.0 >= similarity_thresh:
+                pairs.append((i, j))
+
+    return pairs
+
+def _similar_pairs_star(args):
+    return _similar_pairs(*args)
 
 
 class SpellChecker(object):
     def __init__(self, similarity_thresh = 50):
         self._tokens = {}
         self._total_occurrences = 0 # the sum of all tokens' count members
-        self.__next_touch_id = 0
+        self._index = DeletionIndex() # edit distance index of our tokens used for lookups
 
         # this should not be changed manually (our dictionary will require reprocessing)
         self.__similarity_thresh = similarity_thresh
 
-    def _next_touch_id(self):
-        """only for use by search functions"""
-        self.__next_touch_id = (self.__next_touch_id + 1) % 5000
-        return self.__next_touch_id
-
     @property
     def words(self):
         return self._tokens.iterkeys()
@@ -85,6 +449,7 @@ class SpellChecker(object):
     def load_dictionary_from_tsv(self, file_name):
         """This will throw a RuntimeError if the dictionary is corrupt"""
         self._tokens = {} # free memory
+        self._index = DeletionIndex()
         file_name = os.path.splitext(file_name)[0] + ".tsv" # force extension to .tsv
 
         try:
@@ -108,6 +473,7 @@ class SpellChecker(object):
             # replace string values with actual token objects
             for token in self._tokens.itervalues():
                 token.similar_tokens = set([self._tokens[t] for t in token.similar_tokens])
+                self._index.add(token.value)
 
         except (IndexError, KeyError):
             e = RuntimeError("dictionary file \"%s\" seems to be corrupt" % file_name)
@@ -129,6 +495,34 @@ class SpellChecker(object):
                 file_writer.writerow([token.value, token.count] + [t.value for t in token.similar_tokens])
 
 
+    def load_dictionary_from_bin(self, file_name):
+        """
+        Memory maps a dictionary written by write_dictionary_to_bin(), the dictionary is read-only
+        but loads instantly and is shared by every process that loads (or is pickled with) it.
+        This will throw a RuntimeError if the file isn't a binary dictionary
+        """
+        file_name = os.path.splitext(file_name)[0] + ".bin" # force extension to .bin
+
+        dictionary = MappedDictionary(file_name)
+
+        self._tokens = dictionary
+        self._index = MappedDeletionIndex(dictionary)
+        self.__similarity_thresh = dictionary.similarity_thresh
+        self._total_occurrences = dictionary.total_occurrences
+
+    def write_dictionary_to_bin(self, file_name):
+        """write the dictionary in the compact format read by load_dictionary_from_bin()"""
+
+        # force extension to .bin
+        file_name = os.path.splitext(file_name)[0] + ".bin"
+
+        MappedDictionary.write(file_name, self._tokens, self.__similarity_thresh, self._total_occurrences,
+                               self._index.max_deletes)
+
+    def _check_writable(self):
+        if isinstance(self._tokens, MappedDictionary):
+            raise RuntimeError("dictionaries loaded with load_dictionary_from_bin() are read-only")
+
     def get_best_spelling_correction_slow(self, token_str, target_similarity = 100):
         """perform a slow lookup, only for benchmarking purposes"""
         if token_str in self._tokens:
@@ -156,47 +550,54 @@ class SpellChecker(object):
         the fuzzy match search and just return the existing match
         :param token_str: the string to be matched
         :param target_similarity: a similarity score that will stop the search once reached,
-               if less than __similarity_thresh then stops after first recursive search
+               if less than __similarity_thresh then stops at the first token above the threshold
         :return: a tuple with the match and score as a percent i.e. (match, score)
         """
 
         if token_str in self._tokens:
             return token_str, 100
 
-        touch_id = self._next_touch_id()
+        return self.__fuzzy_correction(token_str, target_similarity)
 
-        best_score = 0
-        best_token = None
+    def correct_many(self, token_strs, target_similarity=80):
+        """
+        Finds the most likely matches to many strings at once (i.e. every word on a page),
+        each distinct string is looked up once and only the ones that aren't in our dictionary verbatim are fuzzy matched
+        :param token_strs: the strings to be matched
+        :param target_similarity: see get_best_spelling_correction()
+        :return: a dict mapping each string to the (match, score) tuple get_best_spelling_correction() would return for it
+        """
 
-        for known_token in self._tokens.itervalues():
-            sim_score = ratio(token_str, known_token.value)
+        unique_strs = set(token_strs)
 
-            if sim_score >= self.__similarity_thresh:
-                most_similar_token, overall_score = self.__find_most_similar_token(token_str, known_token, touch_id,
-                                                                                   sim_score)
-                if overall_score > best_score:
-                    best_token = most_similar_token
-                    best_score = overall_score
-
-                    if best_score >= target_similarity:
-                        break
-        if best_token is not None:
-            best_token_str = best_token.value
+        # resolve exact matches first
+        corrections = dict((s, (s, 100)) for s in unique_strs if s in self._tokens)
+
+        for token_str in unique_strs:
+            if token_str not in corrections:
+                corrections[token_str] = self.__fuzzy_correction(token_str, target_similarity)
+
+        return corrections
+
+    def __fuzzy_correction(self, token_str, target_similarity):
+        best_token_str, best_score = self._index.find_most_similar(token_str, self.__similarity_thresh,
+                                                                   target_similarity)
+
+        if best_token_str is not None:
+            best_token_str = self._tokens[best_token_str].value
         else:
             best_token_str = token_str
 
         return best_token_str, best_score
 
-    def change_similarity_threshold(self, new_sim_thresh):
-        """rebuilds the dictionary with the new similarity threshold"""
+    def change_similarity_threshold(self, new_sim_thresh, processes=1):
+        """rebuilds the dictionary with the new similarity threshold (using processes processes if lowering it)"""
+
+        self._check_writable()
 
         # update our similar tokens lists
         if new_sim_thresh < self.__similarity_thresh:
-            for token1 in self._tokens.itervalues():
-                for token2 in self._tokens.itervalues():
-                    if self.__similarity_thresh > ratio(token1.value, token2.value) >= new_sim_thresh:
-                        token1.similar_tokens.add(token2)
-                        token2.similar_tokens.add(token1)
+            self.__link_similar_tokens(self._tokens.values(), [], new_sim_thresh, processes)
         elif new_sim_thresh > self.__similarity_thresh:
             for token in self._tokens.itervalues():
                 # new similar token list for 'token' (the list can't be change while we iterate through it)
@@ -215,20 +616,21 @@ class SpellChecker(object):
     def remove_all_tokens(self):
         self._tokens = {}
         self._total_occurrences = 0
-        self.__next_touch_id = 0
+        self._index = DeletionIndex()
 
-    def add_common_tokens_from_txt_file(self, fn, num=1000, start=0):
+    def add_common_tokens_from_txt_file(self, fn, num=1000, start=0, processes=1):
         with open(fn,"r") as file:
             txt = file.read()
-            self.add_common_tokens_from_txt(txt, num, start)
+            self.add_common_tokens_from_txt(txt, num, start, processes)
 
-    def add_common_tokens_from_txt(self, text, num=1000, start=0):
+    def add_common_tokens_from_txt(self, text, num=1000, start=0, processes=1):
         """
         finds most common tokens in provided text and adds them to dictionary
         :param text: text to get tokens from
         :param num: number of common tokens to add
         :param start: number of common tokens to skip starting from most common
                       (i.e. 10 would mean ignore the ten most common tokens)
+        :param processes: number of processes to use for finding similar tokens
         :return:
         """
         tokens = tokenize(text)
@@ -239,8 +641,7 @@ class SpellChecker(object):
         # crop out from starting pos
         tokens = tokens[start:]
 
-        for token_str, count in tokens:
-            self.add_token(token_str, count)
+        self.add_tokens(tokens, processes)
 
     def add_token(self, token_str, token_count):
         """
@@ -251,6 +652,8 @@ class SpellChecker(object):
         :return: no return
         """
 
+        self._check_writable()
+
         if token_str in self._tokens:
             self._tokens[token_str].count += token_count
             return
@@ -265,41 +668,103 @@ class SpellChecker(object):
 
         self._total_occurrences += token_count
         self._tokens[token_str] = new_token
+        self._index.add(token_str)
+
+    def add_tokens(self, tokens, processes=1):
+        """
+        Add many tokens to the spell checker's dictionary at once, gives the same result as calling
+        add_token() on each but without comparing every pair of tokens
+        :param tokens: list of (token string, token count) tuples
+        :param processes: number of processes to use for finding similar tokens
+        :return: no return
+        """
+
+        self._check_writable()
+
+        new_tokens = []
+
+        for token_str, token_count in tokens:
+            if token_str in self._tokens:
+                self._tokens[token_str].count += token_count
+                continue
+
+            new_token = Token(token_str, token_count)
+            new_tokens.append(new_token)
+
+            self._total_occurrences += token_count
+            self._tokens[token_str] = new_token
+            self._index.add(token_str)
 
-    def __find_most_similar_token(self, token_str, similar_token, touch_id, sim_score):
+        new_token_set = set(new_tokens)
+        old_tokens = [t for t in self._tokens.itervalues() if t not in new_token_set]
+
+        self.__link_similar_tokens(new_tokens, old_tokens, self.__similarity_thresh, processes)
+
+    def __link_similar_tokens(self, new_tokens, old_tokens, similarity_thresh, processes=1):
         """
-        Searches for the token with spelling closest to token_str starting from similar_token
-        then calls __proximity_search_for_most_likely_match to find the token with the best
-        overall match score (similarity * frequency)
-        :param token_str: string of token to be matched to
-        :param similar_token: a token to start the search from, is assumed to have a high similarity score with token_str
-        :param sim_score: the similarity score between token_str and similar_token
-        :param touch_tag: the touch tag to be used for this search operation
-        :return: (best_token, best_overall_score)
+        adds every pair of tokens with a similarity of at least similarity_thresh to each others similar token lists,
+        pairs between two old_tokens are assumed to be done already
         """
 
-        best_similarity_score = sim_score
-        best_token = similar_token
+        if len(new_tokens) == 0:
+            return
 
-        better_token_found = True
+        tokens = sorted([(t, True) for t in new_tokens] + [(t, False) for t in old_tokens],
+                        key=lambda t: len(unicode(t[0].value)))
+
+        words = [unicode(t.value) for t, _ in tokens]
+        lengths = np.array([len(w) for w in words])
+        is_new = np.array([new for _, new in tokens])
+
+        # count of each character in each word
+        alphabet = dict((c, ix) for ix, c in enumerate(set(itertools.chain.from_iterable(words))))
+        char_counts = np.zeros((len(words), len(alphabet)), np.int16)
+        for ix, w in enumerate(words):
+            for c in w:
+                char_counts[ix, alphabet[c]] += 1
+
+        rows = np.flatnonzero(is_new)
+
+        if processes > 1:
+            pool = multiprocessing.Pool(processes)
+            try:
+                pairs = pool.map(_similar_pairs_star, [(words, lengths, char_counts, is_new, similarity_thresh,
+                                                        rows[n::processes]) for n in xrange(processes)])
+            finally:
+                pool.close()
+                pool.join()
+            pairs = itertools.chain.from_iterable(pairs)
+        else:
+            pairs = _similar_pairs(words, lengths, char_counts, is_new, similarity_thresh, rows)
 
-        while better_token_found:
-            better_token_found = False
+        for i, j in pairs:
+            tokens[i][0].similar_tokens.add(tokens[j][0])
+            tokens[j][0].similar_tokens.add(tokens[i][0])
+
+def benchmark_concurrent_lookups(spell_checker, words, thread_counts=(1, 2, 4, 8), target_similarity=100):
+    """
+    time get_best_spelling_correction() on every word in words split between
+    each number of threads in thread_counts, for benchmarking purposes
+    :return: list of (thread count, lookups per second) tuples
+    """
+    results = []
 
-            for token in best_token.similar_tokens:
-                if not token.touched_by(touch_id):
-                    token.touch_with(touch_id)
-                else:
-                    continue
+    for num_threads in thread_counts:
+        threads = [threading.Thread(target=lambda chunk: [spell_checker.get_best_spelling_correction(w, target_similarity)
+                                                          for w in chunk],
+                                    args=(words[n::num_threads],)) for n in xrange(num_threads)]
 
-                similarity_score = ratio(token_str, token.value)
+        start_time = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start_time
 
-                if similarity_score > best_similarity_score:
-                    best_similarity_score = similarity_score
-                    best_token = token
-                    better_token_found = True
+        results.append((num_threads, len(words) / elapsed))
+        print "%d threads: %f lookups/sec" % results[-1]
 
-        return best_token, best_similarity_score
+    return results
 
 # spell_checker = SpellChecker(similarity_thresh=50)
 #
@@ -0,0 +1,108 @@
+""" A stand-in for the ArcGIS geocoding server used by the tests."""
+
+import json
+import time
+import threading
+import urlparse
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+class ArcGISStub(ThreadingMixIn, HTTPServer):
+    """
+    answers findAddressCandidates and geocodeAddresses requests on a local port (in a background thread),
+    addresses containing "Bad" aren't found, ones containing "Missing" are left out of batch responses
+    and batches with an address containing "Error" fail. Found addresses are located at x = -71 - uid
+    (x = -71.5 for single requests) so results can be matched to what was sent
+    """
+
+    daemon_threads = True
+
+    def __init__(self, delay=0):
+        """:param delay: seconds each request waits before it is answered"""
+        HTTPServer.__init__(self, ("127.0.0.1", 0), _ArcGISStubHandler)
+
+        self.delay = delay
+
+        self.num_requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0 # most requests that were being answered at once
+        self.lock = threading.Lock()
+
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d/GeocodeServer/" % self.server_address[1]
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    @staticmethod
+    def geocode_batch(query):
+        records = json.loads(query["addresses"][0])["records"]
+        addresses = [record["attributes"]["Single Line Input"] for record in records]
+
+        if any("Error" in address for address in addresses):
+            return {"error": {"code": 500, "message": "unable to complete operation"}}
+
+        locations = []
+        for record, address in zip(records, addresses):
+            uid = record["attributes"]["OBJECTID"]
+
+            if "Missing" in address:
+                continue
+            elif "Bad" in address:
+                location = {"x": "NaN", "y": "NaN"}
+                score = 0
+            else:
+                location = {"x": -71.0 - uid, "y": 41.0}
+                score = 90
+
+            locations.append({"attributes": {"ResultID": uid, "Match_addr": address},
+                              "score": score, "location": location})
+
+        return {"locations": locations}
+
+    @staticmethod
+    def geocode(query):
+        if "Bad" in query.get("Street", [""])[0]:
+            return {"candidates": []}
+
+        return {"candidates": [{"score": 95, "address": query["Street"][0], "location": {"x": -71.5, "y": 41.5}}]}
+
+class _ArcGISStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # so connections can be kept alive
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+
+        with server.lock:
+            server.num_requests += 1
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+
+        try:
+            time.sleep(server.delay)
+
+            url = urlparse.urlparse(self.path)
+            query = urlparse.parse_qs(url.query)
+
+            if url.path.endswith("geocodeAddresses"):
+                body = json.dumps(server.geocode_batch(query))
+            else:
+                body = json.dumps(server.geocode(query))
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
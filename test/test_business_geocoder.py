@@ -0,0 +1,151 @@
+""" Checks geocoding businesses against a stand-in for the geocoding server."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from georeg import business_geocoder as geo
+from georeg.brownarcgis import BrownArcGIS
+from georeg.geocode_cache import GeocodeCache
+from georeg.geocode_client import ConcurrentGeocoder
+from georeg.registry_processor import Business
+
+from arcgis_stub import ArcGISStub
+
+def make_business(address, city="Providence", zip="02903"):
+    business = Business()
+    business.address = address
+    business.city = city
+    business.zip = zip
+    return business
+
+class GeocoderTestCase(unittest.TestCase):
+    """points business_geocoder at a new ArcGISStub for each test"""
+
+    delay = 0 # seconds the stub takes to answer a request
+
+    def setUp(self):
+        self.server = ArcGISStub(self.delay)
+
+        self.saved = geo.geolocator, geo.geocode_cache, geo.geocode_client
+
+        geo.geolocator = BrownArcGIS()
+        geo.geolocator.api = self.server.url + "findAddressCandidates"
+        geo.geolocator.batch_api = self.server.url + "geocodeAddresses"
+        geo.geocode_cache = None
+        geo.geocode_client = None
+
+    def tearDown(self):
+        if geo.geocode_client is not None:
+            geo.geocode_client.close()
+
+        geo.geolocator, geo.geocode_cache, geo.geocode_client = self.saved
+
+        self.server.stop()
+
+class TestGeocodeBusinesses(GeocoderTestCase):
+
+    def test_results_go_to_their_business(self):
+        geo.geolocator.batch_size = 2
+        businesses = [make_business("%d Main St" % (n + 1)) for n in xrange(5)]
+
+        successes = geo.geocode_businesses(businesses)
+
+        self.assertEqual(successes, [True] * 5)
+        self.assertEqual(self.server.num_requests, 3) # 5 addresses 2 at a time
+
+        # the stub puts each address at x = -71 - uid and uids are indices into businesses
+        for uid, business in enumerate(businesses):
+            self.assertEqual(business.long, -71.0 - uid)
+            self.assertEqual(business.lat, 41.0)
+            self.assertEqual(business.confidence_score, 90.0)
+
+    def test_unmatched_and_missing_results(self):
+        businesses = [make_business("1 Main St"), make_business("2 Bad St"),
+                      make_business("3 Missing St"), make_business("4 Main St")]
+
+        successes = geo.geocode_businesses(businesses)
+
+        self.assertEqual(successes, [True, False, False, True])
+        self.assertEqual(businesses[3].long, -74.0)
+
+        for business in businesses[1:3]:
+            self.assertEqual(business.lat, "")
+            self.assertEqual(business.long, "")
+            self.assertEqual(business.confidence_score, 0.0)
+
+    def test_failed_batch(self):
+        geo.geolocator.batch_size = 2
+        businesses = [make_business("1 Main St"), make_business("2 Error St"), make_business("3 Main St")]
+
+        successes = geo.geocode_businesses(businesses)
+
+        # only the batch the server failed on is lost
+        self.assertEqual(successes, [False, False, True])
+        self.assertEqual(businesses[2].long, -73.0)
+
+    def test_numeric_fields_cleaned(self):
+        business = make_business("I2 Main St", zip="0290I")
+
+        self.assertEqual(geo.geocode_businesses([business]), [True])
+        self.assertEqual(business.address, "12 Main St")
+        self.assertEqual(business.zip, "02901")
+
+    def test_cached_results(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            geo.geocode_cache = GeocodeCache(os.path.join(temp_dir, "cache.sqlite"))
+            geo.geolocator.batch_size = 1
+
+            businesses = [make_business("1 Main St"), make_business("2 Bad St"), make_business("3 Error St")]
+            self.assertEqual(geo.geocode_businesses(businesses), [True, False, False])
+            self.assertEqual(self.server.num_requests, 3)
+
+            # found and not found addresses come from the cache, the failed request is sent again
+            businesses = [make_business("1 main st."), make_business("2 Bad St"), make_business("3 Error St")]
+            self.assertEqual(geo.geocode_businesses(businesses), [True, False, False])
+            self.assertEqual(self.server.num_requests, 4)
+            self.assertEqual(businesses[0].long, -71.0)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_retry_not_found(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            geo.geocode_cache = GeocodeCache(os.path.join(temp_dir, "cache.sqlite"))
+
+            geo.geocode_businesses([make_business("1 Main St"), make_business("2 Bad St")])
+            self.assertEqual(self.server.num_requests, 1)
+
+            # the address that wasn't found is asked for again, the one that was comes from the cache
+            geo.geolocator.batch_size = 1
+            businesses = [make_business("1 Main St"), make_business("2 Bad St")]
+            self.assertEqual(geo.geocode_businesses(businesses, retry_not_found=True), [True, False])
+            self.assertEqual(self.server.num_requests, 2)
+        finally:
+            shutil.rmtree(temp_dir)
+
+class TestGeocodeEach(GeocoderTestCase):
+
+    delay = 0.2
+
+    def test_one_request_at_a_time(self):
+        businesses = [make_business("%d Main St" % (n + 1)) for n in xrange(3)] + [make_business("4 Bad St")]
+
+        self.assertEqual(geo.geocode_each(businesses), [True, True, True, False])
+        self.assertEqual(self.server.num_requests, 4)
+        self.assertEqual(self.server.max_in_flight, 1)
+        self.assertEqual(businesses[0].long, -71.5)
+
+    def test_requests_in_flight_at_once(self):
+        geo.geocode_client = ConcurrentGeocoder(geo.geolocator, max_in_flight=4)
+        businesses = [make_business("%d Main St" % (n + 1)) for n in xrange(7)] + [make_business("8 Bad St")]
+
+        self.assertEqual(geo.geocode_each(businesses), [True] * 7 + [False])
+        self.assertEqual(self.server.num_requests, 8)
+        self.assertGreater(self.server.max_in_flight, 1)
+        self.assertLessEqual(self.server.max_in_flight, 4)
+
+if __name__ == "__main__":
+    unittest.main()
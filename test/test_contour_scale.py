@@ -0,0 +1,86 @@
+""" Checks the contours found on a scaled copy of an image against the full scale ones."""
+
+import os
+import unittest
+
+import cv2
+
+from georeg.registry_processor import RegistryProcessor
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+configs_dir = os.path.join(test_dir, os.pardir, "georeg", "configs")
+
+def overlap(a, b):
+    """intersection over union of the bounding boxes of two contour table rows"""
+    w = min(a["x"] + a["w"], b["x"] + b["w"]) - max(a["x"], b["x"])
+    h = min(a["y"] + a["h"], b["y"] + b["h"]) - max(a["y"], b["y"])
+    intersection = max(0, w) * max(0, h)
+    return intersection * 1.0 / (a["w"] * a["h"] + b["w"] * b["h"] - intersection)
+
+class TestContourScale(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        image = cv2.imread(os.path.join(test_dir, "img.png"), cv2.IMREAD_GRAYSCALE)
+        height, width = image.shape
+
+        # dark bands along the edges (like the shadows of a scan) make contours that touch the border
+        image[:, :40] = 0
+        image[:, width - 60:] = 0
+        image[:30, 800:1500] = 0
+        image[height - 35:, 200:900] = 0
+
+        cls.path = os.path.join(test_dir, "edges.png")
+        cv2.imwrite(cls.path, image)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.path)
+
+    def setUp(self):
+        self.reg_processor = RegistryProcessor()
+        self.reg_processor.load_settings_from_cfg(os.path.join(configs_dir, "RI", "1979.cfg"))
+
+    def get_contour_table(self, scale):
+        self.reg_processor.contour_scale = scale
+        self.reg_processor._load_image(self.path)
+        return self.reg_processor._get_contour_table(make_new_thresh = True)
+
+    def test_scaled_contours(self):
+        full_table = self.get_contour_table(1.0)
+        width, height = self.reg_processor._image_width, self.reg_processor._image_height
+
+        # the sides of the image a contour touches (at full scale they are at 0 or 1 from the border)
+        edges = lambda row: (row["x"] <= 1, row["y"] <= 1,
+                             row["x"] + row["w"] >= width - 1, row["y"] + row["h"] >= height - 1)
+
+        self.assertTrue(any(any(edges(row)) for row in full_table))
+
+        for scale in (0.5, 0.25):
+            table = self.get_contour_table(scale)
+
+            self.assertTrue((table["x"] >= 0).all() and (table["y"] >= 0).all())
+            self.assertTrue((table["x"] + table["w"] <= width).all() and (table["y"] + table["h"] <= height).all())
+
+            overlaps = []
+            for full_row in full_table:
+                row = max(table, key=lambda row: overlap(full_row, row))
+                overlaps.append(overlap(full_row, row))
+
+                self.assertGreater(overlaps[-1], 0.5)
+
+                # contours at the edge must stay there or _remove_edge_contours() won't find them
+                if any(edges(full_row)):
+                    self.assertEqual(edges(row), edges(full_row))
+
+                    for at_edge, (name, full_value, value) in zip(edges(full_row), [
+                            ("x", full_row["x"], row["x"]), ("y", full_row["y"], row["y"]),
+                            ("x + w", full_row["x"] + full_row["w"], row["x"] + row["w"]),
+                            ("y + h", full_row["y"] + full_row["h"], row["y"] + row["h"])]):
+                        if at_edge:
+                            self.assertEqual(value, full_value, "%s of an edge contour at scale %s" % (name, scale))
+
+            self.assertGreater(sum(overlaps) / len(overlaps), 0.9)
+
+if __name__ == "__main__":
+    unittest.main()